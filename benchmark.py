@@ -0,0 +1,273 @@
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import subprocess
+import multiprocessing
+from create_inverted_index import InvertedIndex
+from run_query import QueryEngine
+from vector_engine import VectorQueryEngine
+from index_file import write_binary_index
+
+# the two collections in the repo: prebuilt indexes plus the corpus folders they were built from (if they are present)
+COLLECTIONS = {
+    'rap': {
+        'corpus': 'corpus_songs',
+        'weighted_index': 'rap_tfxidf_weighted_index.json',
+        'raw_index': 'rap_raw_count_index.json',
+        'doc_mapping': 'rap_document_mapping.json',
+    },
+    'time': {
+        'corpus': 'corpus_time_test',
+        'weighted_index': 'time_test_tfxidf_weighted_index.json',
+        'raw_index': 'time_test_raw_count_index.json',
+        'doc_mapping': 'time_test_document_mapping.json',
+    },
+}
+
+RAP_QUERIES = [
+    'cars money dollars quarters',
+    'medicine doctor nurse hospital',
+    'kunta king lamar kendrick',
+    'drunk drink alcohol',
+]
+
+
+def peak_rss_mb():
+    # high water mark of the resident set size, from /proc on linux (in kB). Unlike ru_maxrss it is not inherited
+    # from the parent, so a spawned benchmark process reports its own peak
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def current_rss_mb():
+    # resident set size right now, from /proc on linux (the second field of statm is in pages)
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except OSError:
+        return None
+
+
+def percentiles(latencies):
+    """
+    Returns p50/p95/p99 (in milliseconds) and queries per second of a list of latencies in seconds
+    """
+    latencies = sorted(latencies)
+    def percentile(p):
+        return latencies[min(len(latencies) - 1, int(p / 100 * len(latencies)))] * 1000
+    return {
+        'queries': len(latencies),
+        'p50_ms': percentile(50),
+        'p95_ms': percentile(95),
+        'p99_ms': percentile(99),
+        'qps': len(latencies) / sum(latencies) if sum(latencies) else 0,
+    }
+
+
+def benchmark_build(corpus_root):
+    """
+    Times every stage of InvertedIndex on a corpus folder, runs in its own process so peak RSS is for the build alone
+    """
+    timings = {}
+    start = time.perf_counter()
+    index = InvertedIndex(corpus_root)
+    timings['init_s'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    all_tokens = {}
+    for i, (doc_name, text) in enumerate(index.source):
+        index.doc_map[i+1] = [doc_name, 0]
+        all_tokens[i+1] = index.tokenize_text(text)
+    index.total_docs = len(all_tokens)
+    timings['tokenize_s'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    compiled_list = index.combine_document_tokens(all_tokens)
+    timings['combine_sort_s'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    index.inverted_index = index.merge_tokens(compiled_list)
+    timings['merge_s'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    index.calculate_weighted_index()
+    timings['weighting_s'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    index.calculate_document_vector_lengths()
+    timings['doc_lengths_s'] = time.perf_counter() - start
+
+    timings['total_s'] = sum(timings.values())
+    timings['documents'] = index.total_docs
+    timings['terms'] = len(index.inverted_index)
+    timings['postings'] = sum(values[0] for values in index.inverted_index.values())
+    timings['tokens_per_second'] = index.analyzer.tokens_per_second()
+    timings['peak_rss_mb'] = peak_rss_mb()
+    return timings
+
+
+def benchmark_load(inverted_index_file, doc_mapping_file=None, compact=False):
+    """
+    Times loading an index into a QueryEngine, runs in its own process so peak RSS is for the engine alone.
+    rss_mb is the memory the loaded engine keeps, peak_rss_mb includes what parsing the index took on the way
+    """
+    start = time.perf_counter()
+    engine = QueryEngine(inverted_index_file, doc_mapping_file, cache_size=0, compact=compact)
+    load_s = time.perf_counter() - start
+    engine.query(RAP_QUERIES[0], print_results=False)
+    return {'load_s': load_s, 'rss_mb': current_rss_mb(), 'peak_rss_mb': peak_rss_mb()}
+
+
+def benchmark_queries(inverted_index_file, doc_mapping_file, queries, num_results=10, engine_class=QueryEngine, compact=False):
+    """
+    Measures single query latency and batched throughput, the result cache is turned off
+    """
+    engine = engine_class(inverted_index_file, doc_mapping_file, cache_size=0, compact=compact)
+    results = {}
+
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        engine.query(query, num_results=num_results, print_results=False)
+        latencies.append(time.perf_counter() - start)
+    results['single'] = percentiles(latencies)
+
+    start = time.perf_counter()
+    engine.query_batch(queries, num_results)
+    batch_s = time.perf_counter() - start
+    results['batch'] = {'queries': len(queries), 'seconds': batch_s, 'qps': len(queries) / batch_s if batch_s else 0}
+    return results
+
+
+def sample_queries(raw_index_file, num_queries, seed=0):
+    """
+    Builds random queries of 1-5 terms, drawing terms with probability proportional to their collection frequency
+    """
+    with open(raw_index_file) as f:
+        raw_index = json.load(f)
+    rng = random.Random(seed)
+    terms = list(raw_index)
+    weights = [values[1] for values in raw_index.values()]
+    return [' '.join(rng.choices(terms, weights=weights, k=rng.randint(1, 5))) for i in range(num_queries)]
+
+
+def time_queries(queries_file):
+    """
+    Reads the queries of the TIME test collection
+    """
+    queries = []
+    with open(queries_file) as f:
+        for line in f:
+            if line.startswith('*FIND'):
+                queries.append('')
+            elif not line.startswith('*STOP') and queries:
+                queries[-1] += line
+    return queries
+
+
+def create_synthetic_corpus(raw_index_file, folder, num_docs, seed=0):
+    """
+    Writes num_docs documents of random words drawn with the collection frequencies of an existing index
+    """
+    with open(raw_index_file) as f:
+        raw_index = json.load(f)
+    rng = random.Random(seed)
+    terms = list(raw_index)
+    weights = [values[1] for values in raw_index.values()]
+    os.makedirs(folder, exist_ok=True)
+    for i in range(num_docs):
+        words = rng.choices(terms, weights=weights, k=rng.randint(100, 500))
+        with open(os.path.join(folder, f'Synthetic_{i}.txt'), 'w') as f:
+            for j in range(0, len(words), 8):
+                f.write(' '.join(words[j:j + 8]) + '\n')
+
+
+def run_isolated(function, *args):
+    """
+    Runs a benchmark function in a fresh process so its timings and peak RSS are not affected by earlier runs
+    """
+    with multiprocessing.get_context('spawn').Pool(1) as pool:
+        return pool.apply(function, args)
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], text=True, stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks index construction, index loading and query latency')
+    parser.add_argument('--collections', nargs='*', default=list(COLLECTIONS), choices=list(COLLECTIONS))
+    parser.add_argument('--scale', nargs='*', type=int, default=[1000, 5000], help='sizes of the synthetic corpora to build')
+    parser.add_argument('--queries', type=int, default=500, help='number of sampled queries per collection')
+    parser.add_argument('--num-results', type=int, default=10)
+    parser.add_argument('--output', default=None, help='json file to write, defaults to bench_results/<commit>.json')
+    args = parser.parse_args()
+
+    report = {'commit': git_commit(), 'timestamp': time.time(), 'python': sys.version.split()[0], 'collections': {}, 'synthetic': {}}
+
+    for name in args.collections:
+        files = COLLECTIONS[name]
+        results = {}
+        if os.path.isdir(files['corpus']):
+            print(f'{name}: building index from {files["corpus"]}')
+            results['build'] = run_isolated(benchmark_build, os.path.abspath(files['corpus']))
+
+        print(f'{name}: loading indexes')
+        results['load_json'] = run_isolated(benchmark_load, files['weighted_index'], files['doc_mapping'])
+        results['load_compact'] = run_isolated(benchmark_load, files['weighted_index'], files['doc_mapping'], True)
+        binary_file = os.path.join(tempfile.mkdtemp(), f'{name}.idx')
+        with open(files['weighted_index']) as f, open(files['doc_mapping']) as g:
+            write_binary_index(binary_file, json.load(f), json.load(g))
+        results['load_binary'] = run_isolated(benchmark_load, binary_file)
+
+        queries = sample_queries(files['raw_index'], args.queries)
+        if name == 'rap':
+            queries = RAP_QUERIES + queries
+        elif os.path.exists('test_data/TIME.QUE'):
+            queries = time_queries('test_data/TIME.QUE') + queries
+
+        print(f'{name}: running {len(queries)} queries')
+        results['queries_json'] = run_isolated(benchmark_queries, files['weighted_index'], files['doc_mapping'], queries, args.num_results)
+        results['queries_compact'] = run_isolated(benchmark_queries, files['weighted_index'], files['doc_mapping'], queries, args.num_results,
+                                                  QueryEngine, True)
+        results['queries_binary'] = run_isolated(benchmark_queries, binary_file, None, queries, args.num_results)
+        try:
+            results['queries_vector'] = run_isolated(benchmark_queries, binary_file, None, queries, args.num_results, VectorQueryEngine)
+        except ImportError:
+            print('numpy is not installed, skipping VectorQueryEngine')
+        shutil.rmtree(os.path.dirname(binary_file))
+        report['collections'][name] = results
+
+    for num_docs in args.scale:
+        folder = tempfile.mkdtemp(prefix=f'synthetic_{num_docs}_')
+        try:
+            print(f'synthetic: building index over {num_docs} documents')
+            create_synthetic_corpus(COLLECTIONS['rap']['raw_index'], folder, num_docs)
+            report['synthetic'][str(num_docs)] = run_isolated(benchmark_build, folder)
+        finally:
+            shutil.rmtree(folder)
+
+    output = args.output or os.path.join('bench_results', f'{(report["commit"] or "unknown")[:12]}.json')
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f'results written to {output}')
+
+
+# python benchmark.py --scale 1000 5000 --queries 500
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+import re
+from postings_ops import intersect, union, difference
+
+OPERATORS = ('AND', 'OR', 'NOT')
+TOKEN_PATTERN = re.compile(r'\(|\)|[^\s()]+')
+
+
+def parse_boolean_query(query):
+    """
+    Parses a Boolean query into a tree of ('term', word), ('and', [nodes]), ('or', [nodes]) and ('not', node).
+    Operators are upper case, NOT binds tighter than AND which binds tighter than OR, words next to each other are ANDed:
+        kendrick lamar NOT (drake OR future)
+    """
+    tokens = TOKEN_PATTERN.findall(query)
+    node, position = _parse_or(tokens, 0)
+    if position != len(tokens):
+        raise ValueError(f'unexpected {tokens[position]!r} in boolean query')
+    return node
+
+
+def _parse_or(tokens, position):
+    nodes = []
+    node, position = _parse_and(tokens, position)
+    nodes.append(node)
+    while position < len(tokens) and tokens[position] == 'OR':
+        node, position = _parse_and(tokens, position + 1)
+        nodes.append(node)
+    return (nodes[0] if len(nodes) == 1 else ('or', nodes)), position
+
+
+def _parse_and(tokens, position):
+    nodes = []
+    node, position = _parse_not(tokens, position)
+    nodes.append(node)
+    while position < len(tokens) and tokens[position] not in ('OR', ')'):
+        if tokens[position] == 'AND':
+            position += 1
+        node, position = _parse_not(tokens, position)
+        nodes.append(node)
+    return (nodes[0] if len(nodes) == 1 else ('and', nodes)), position
+
+
+def _parse_not(tokens, position):
+    if position < len(tokens) and tokens[position] == 'NOT':
+        node, position = _parse_not(tokens, position + 1)
+        return ('not', node), position
+    return _parse_atom(tokens, position)
+
+
+def _parse_atom(tokens, position):
+    if position == len(tokens):
+        raise ValueError('boolean query ends with an operator')
+    token = tokens[position]
+    if token == '(':
+        node, position = _parse_or(tokens, position + 1)
+        if position == len(tokens) or tokens[position] != ')':
+            raise ValueError('missing ) in boolean query')
+        return node, position + 1
+    if token in OPERATORS or token == ')':
+        raise ValueError(f'unexpected {token!r} in boolean query')
+    return ('term', token), position + 1
+
+
+def query_terms(node):
+    """
+    Returns the words of a query tree that are not under a NOT, the ones a matching document is scored on
+    """
+    if node[0] == 'term':
+        return [node[1]]
+    if node[0] == 'not':
+        return []
+    return [word for child in node[1] for word in query_terms(child)]
+
+
+def evaluate_boolean(node, term_doc_ids, all_doc_ids):
+    """
+    Returns the sorted doc ids matching a query tree, or None when the tree does not constrain the documents
+    (e.g. it only has stop words). term_doc_ids(word) returns the sorted doc ids of a word or None for a stop word,
+    all_doc_ids() the sorted doc ids of the whole collection which is only needed for a NOT on its own.
+    ANDs intersect their operands rarest first with galloping search and subtract their NOT operands
+    """
+    kind = node[0]
+    if kind == 'term':
+        return term_doc_ids(node[1])
+
+    if kind == 'not':
+        excluded = evaluate_boolean(node[1], term_doc_ids, all_doc_ids)
+        return None if excluded is None else difference(all_doc_ids(), excluded)
+
+    if kind == 'or':
+        operands = [evaluate_boolean(child, term_doc_ids, all_doc_ids) for child in node[1]]
+        if any(operand is None for operand in operands):
+            return None
+        return union(operands)
+
+    # and: NOT operands are subtracted from the intersection instead of being complemented
+    included = []
+    excluded = []
+    for child in node[1]:
+        if child[0] == 'not':
+            operand = evaluate_boolean(child[1], term_doc_ids, all_doc_ids)
+            if operand is not None:
+                excluded.append(operand)
+        else:
+            operand = evaluate_boolean(child, term_doc_ids, all_doc_ids)
+            if operand is not None:
+                included.append(operand)
+
+    if not included:
+        if not excluded:
+            return None
+        included = [all_doc_ids()]
+    doc_ids = [doc_id for doc_id, indexes in intersect(included)] if len(included) > 1 else list(included[0])
+    for operand in excluded:
+        doc_ids = difference(doc_ids, operand)
+    return doc_ids
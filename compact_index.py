@@ -0,0 +1,206 @@
+import json
+from array import array
+from json.decoder import WHITESPACE
+
+
+class CompactIndex:
+    """
+    In-memory index with the {term: [doc_freq, total_freq, postings_list]} interface of the json index in a compact layout.
+    Terms are interned to ids (in index order) and the postings of all terms are back to back in one array of
+    doc ids and one of weights, the postings of term t are doc_ids[offsets[t]:offsets[t+1]]. A posting takes 12 bytes
+    instead of the two element list of an int and a float the json index holds for it.
+    postings() hands out memoryview slices of the arrays, so nothing is allocated per posting while scoring, and the
+    [[doc_id, weight], ...] lists of __getitem__ are only materialized when a term is looked up that way
+    """
+
+    def __init__(self, inverted_index, doc_mapping):
+        # inverted_index is a {term: [doc_freq, total_freq, postings_list]} dict or an iterable of (term, values) pairs
+        if hasattr(inverted_index, 'items'):
+            inverted_index = inverted_index.items()
+
+        self.terms = []
+        self.term_ids = {}
+        doc_ids = array('I')
+        weights = array('d')
+        offsets = array('Q', [0])
+        total_freqs = array('Q')
+        for term, (doc_freq, total_freq, postings_list) in inverted_index:
+            self.term_ids[term] = len(self.terms)
+            self.terms.append(term)
+            for doc_id, weight in postings_list:
+                doc_ids.append(int(doc_id))
+                weights.append(weight)
+            offsets.append(len(doc_ids))
+            total_freqs.append(int(total_freq))
+        self.doc_ids = doc_ids
+        self.weights = weights
+        self.offsets = offsets
+        self.total_freqs = total_freqs
+        self._doc_ids_view = memoryview(doc_ids)
+        self._weights_view = memoryview(weights)
+
+        # largest weight / doc length of every term, computed on first use (-1 until then)
+        self.max_scores = array('d', [-1.0]) * len(self.terms)
+        self.doc_mapping = CompactDocMapping(doc_mapping)
+        self.doc_lengths = self.doc_mapping.doc_lengths
+
+    @classmethod
+    def load(cls, inverted_index_file, doc_mapping_file):
+        """
+        Loads a json index and document mapping. The index is parsed one term at a time (see iter_json_object)
+        so the postings lists of the whole index never exist as python objects at once
+        """
+        with open(doc_mapping_file) as f:
+            doc_mapping = json.load(f)
+        with open(inverted_index_file) as f:
+            text = f.read()
+        return cls(iter_json_object(text), doc_mapping)
+
+    def _range(self, term):
+        term_id = self.term_ids.get(term)
+        if term_id is None:
+            return None, 0, 0
+        return term_id, self.offsets[term_id], self.offsets[term_id + 1]
+
+    def postings(self, term):
+        """
+        Returns the (doc_ids, weights) of a term's postings list or None if the term is not in the index
+        """
+        term_id, start, end = self._range(term)
+        if term_id is None:
+            return None
+        return self._doc_ids_view[start:end], self._weights_view[start:end]
+
+    def max_score(self, term):
+        """
+        Returns the largest weight / doc_vector_length in the postings list of a term
+        """
+        term_id, start, end = self._range(term)
+        if term_id is None:
+            raise KeyError(term)
+        if self.max_scores[term_id] < 0:
+            max_score = 0
+            doc_lengths = self.doc_lengths
+            for i in range(start, end):
+                doc_length = doc_lengths[self.doc_ids[i]]
+                if doc_length and self.weights[i] / doc_length > max_score:
+                    max_score = self.weights[i] / doc_length
+            self.max_scores[term_id] = max_score
+        return self.max_scores[term_id]
+
+    def doc_freqs(self):
+        """
+        Yields (term, doc_freq) for every term in index order
+        """
+        offsets = self.offsets
+        for term_id, term in enumerate(self.terms):
+            yield term, offsets[term_id + 1] - offsets[term_id]
+
+    def iter_postings(self):
+        """
+        Yields (term, doc_ids, weights) for every term in index order
+        """
+        for term in self.terms:
+            yield (term,) + self.postings(term)
+
+    def __len__(self):
+        return len(self.terms)
+
+    def __contains__(self, term):
+        return term in self.term_ids
+
+    def __getitem__(self, term):
+        term_id, start, end = self._range(term)
+        if term_id is None:
+            raise KeyError(term)
+        postings_list = [[self.doc_ids[i], self.weights[i]] for i in range(start, end)]
+        return [end - start, self.total_freqs[term_id], postings_list]
+
+    def keys(self):
+        return iter(self.terms)
+
+    def __iter__(self):
+        return iter(self.terms)
+
+
+class CompactDocMapping:
+    """
+    {doc_id: [doc_name, doc_vector_length]} view (doc ids as string keys like the json mapping) over parallel arrays indexed by int doc id.
+    doc_lengths[doc_id] is what the scoring loops read, missing doc ids have a length of 0
+    """
+
+    def __init__(self, doc_mapping):
+        # the string keys are kept (one per document, not per posting) since exhaustive scoring iterates over them for every query
+        self.doc_keys = [str(doc_id) for doc_id in doc_mapping.keys()]
+        self.ids = array('I', (int(doc_id) for doc_id in self.doc_keys))
+        size = max(self.ids) + 1 if self.ids else 0
+        self.names = [None] * size
+        self.doc_lengths = array('d', [0.0]) * size
+        for doc_id, (doc_name, doc_length) in doc_mapping.items():
+            self.names[int(doc_id)] = doc_name
+            self.doc_lengths[int(doc_id)] = doc_length
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, doc_id):
+        doc_id = int(doc_id)
+        return 0 <= doc_id < len(self.names) and self.names[doc_id] is not None
+
+    def __getitem__(self, doc_id):
+        if doc_id not in self:
+            raise KeyError(doc_id)
+        doc_id = int(doc_id)
+        return [self.names[doc_id], self.doc_lengths[doc_id]]
+
+    def keys(self):
+        return iter(self.doc_keys)
+
+    def items(self):
+        for key, doc_id in zip(self.doc_keys, self.ids):
+            yield key, [self.names[doc_id], self.doc_lengths[doc_id]]
+
+    def __iter__(self):
+        return self.keys()
+
+
+def doc_length_table(doc_mapping):
+    """
+    Returns the doc vector lengths of a document mapping in a sequence indexed by int doc id (0 for missing doc ids),
+    so the scoring loops do not build a string key and look up the mapping for every posting
+    """
+    if hasattr(doc_mapping, 'doc_lengths'):
+        return doc_mapping.doc_lengths
+    doc_lengths = {int(doc_id): values[1] for doc_id, values in doc_mapping.items()}
+    table = array('d', [0.0]) * (max(doc_lengths) + 1 if doc_lengths else 0)
+    for doc_id, doc_length in doc_lengths.items():
+        table[doc_id] = doc_length
+    return table
+
+
+def iter_json_object(text):
+    """
+    Yields the (key, value) pairs of the top level object of a json document one at a time,
+    only the value being yielded is parsed into python objects
+    """
+    decoder = json.JSONDecoder()
+    position = WHITESPACE.match(text, 0).end()
+    if text[position:position + 1] != '{':
+        raise ValueError('expected a json object')
+    position = WHITESPACE.match(text, position + 1).end()
+    if text[position:position + 1] == '}':
+        return
+    while True:
+        key, position = decoder.raw_decode(text, position)
+        position = WHITESPACE.match(text, position).end()
+        if text[position:position + 1] != ':':
+            raise ValueError(f'expected : at position {position}')
+        position = WHITESPACE.match(text, position + 1).end()
+        value, position = decoder.raw_decode(text, position)
+        yield key, value
+        position = WHITESPACE.match(text, position).end()
+        if text[position:position + 1] == '}':
+            return
+        if text[position:position + 1] != ',':
+            raise ValueError(f'expected , or }} at position {position}')
+        position = WHITESPACE.match(text, position + 1).end()
@@ -0,0 +1,135 @@
+import os
+import json
+import tarfile
+import zipfile
+
+# corpus sources stream (doc_name, text) pairs into InvertedIndex. Any iterable of pairs works as a source,
+# the classes below can be iterated more than once (e.g. to build the index and then the positional index)
+# and only hold one document in memory at a time
+
+
+def document_name(path):
+    """
+    Names a document after its file like the indexer always has (everything before the first '.'),
+    files in subfolders keep their folder so equal file names in different folders stay apart
+    """
+    folder, filename = os.path.split(path)
+    name = filename.split('.')[0]
+    return f'{folder.replace(os.sep, "/")}/{name}' if folder else name
+
+
+class DirectorySource:
+    """
+    Every file under a folder is a document, subfolders included (recursive=False only reads the top folder).
+    Files are read in os.walk order, the top folder first
+    """
+
+    def __init__(self, root, recursive=True, encoding='latin1'):
+        self.root = root
+        self.recursive = recursive
+        self.encoding = encoding
+
+    def paths(self):
+        """
+        Returns the paths of the documents relative to the root folder
+        """
+        paths = []
+        for folder, dirs, files in os.walk(self.root):
+            relative_folder = os.path.relpath(folder, self.root)
+            for filename in files:
+                paths.append(filename if relative_folder == '.' else os.path.join(relative_folder, filename))
+            if not self.recursive:
+                break
+        return paths
+
+    def read(self, path):
+        """
+        Returns the (doc_name, text) of a file given its path relative to the root folder
+        """
+        with open(os.path.join(self.root, path), 'r', encoding=self.encoding) as f:
+            return document_name(path), f.read()
+
+    def __iter__(self):
+        for path in self.paths():
+            yield self.read(path)
+
+
+class TimeSource:
+    """
+    A TIME.ALL style file holding many documents, each starting with a '*TEXT <number> ...' line, with '*STOP' at the end.
+    Documents are named text_<number> like create_corpus_from_test_data.py names the files it splits them into
+    """
+
+    def __init__(self, filename, encoding='latin1'):
+        self.filename = filename
+        self.encoding = encoding
+
+    def __iter__(self):
+        doc_name = None
+        lines = []
+        with open(self.filename, 'r', encoding=self.encoding) as f:
+            for line in f:
+                if line.startswith('*TEXT') or line.startswith('*STOP'):
+                    if doc_name is not None:
+                        yield doc_name, ''.join(lines)
+                    doc_name = f'text_{line.split()[1]}' if line.startswith('*TEXT') else None
+                    lines = []
+                elif doc_name is not None:
+                    lines.append(line)
+        if doc_name is not None:
+            yield doc_name, ''.join(lines)
+
+
+class JsonlSource:
+    """
+    One json object per line, the document name and text are read from name_field and text_field
+    """
+
+    def __init__(self, filename, name_field='name', text_field='text'):
+        self.filename = filename
+        self.name_field = name_field
+        self.text_field = text_field
+
+    def __iter__(self):
+        with open(self.filename, 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    document = json.loads(line)
+                    yield str(document[self.name_field]), document[self.text_field]
+
+
+class ArchiveSource:
+    """
+    Every file in a tar (optionally compressed) or zip archive is a document, read in archive order without extracting it.
+    Tar archives are read as a stream so compressed archives are decompressed sequentially in one pass
+    """
+
+    def __init__(self, filename, encoding='latin1'):
+        self.filename = filename
+        self.encoding = encoding
+
+    def __iter__(self):
+        if zipfile.is_zipfile(self.filename):
+            with zipfile.ZipFile(self.filename) as archive:
+                for info in archive.infolist():
+                    if not info.is_dir():
+                        with archive.open(info) as f:
+                            yield document_name(info.filename), f.read().decode(self.encoding)
+        else:
+            with tarfile.open(self.filename, 'r|*') as archive:
+                for member in archive:
+                    if member.isfile():
+                        yield document_name(member.name), archive.extractfile(member).read().decode(self.encoding)
+
+
+def open_corpus(path, **kwargs):
+    """
+    Returns the source for a corpus path: a folder, a .jsonl file, a tar or zip archive, or otherwise a TIME.ALL style file
+    """
+    if os.path.isdir(path):
+        return DirectorySource(path, **kwargs)
+    if path.endswith('.jsonl'):
+        return JsonlSource(path, **kwargs)
+    if zipfile.is_zipfile(path) or tarfile.is_tarfile(path):
+        return ArchiveSource(path, **kwargs)
+    return TimeSource(path, **kwargs)
@@ -1,46 +1,168 @@
-import string
-import nltk
 import os
 import json
 import math
-import copy
+import multiprocessing
+from index_file import write_binary_index
+from spimi_index import SpimiIndexBuilder, MAX_FAN_IN
+from sharded_index import export_shards
+from text_analyzer import TextAnalyzer
+from instrumentation import NULL_METRICS
+from weighting import get_scheme, document_token_counts
+from positional_index import PositionalIndex
+from impact_index import ImpactIndex, check_bits
+from corpus_sources import DirectorySource
+
+
+def write_json(filename, data):
+    """
+    Writes data to a json file, written to a temporary file first and moved in place
+    so a QueryEngine reloading the file never reads it half written
+    """
+    temp_filename = filename + '.tmp'
+    with open(temp_filename, 'w') as f:
+        json.dump(data, f)
+    os.replace(temp_filename, filename)
 
 class InvertedIndex:
     """
-    Class to create an inverted index given a folder path to a corpus where each file is treated as a seperate index
+    Class to create an inverted index given a folder path to a corpus where each file is treated as a seperate index,
+    or given a corpus source that streams (doc_name, text) pairs (see corpus_sources.py)
     """
 
-    def __init__(self, corpus_root):
+    def __init__(self, corpus_root=None, analyzer=None, metrics=None, source=None):
         self.corpus_root = corpus_root
 
-        # documents are assumed to all be under the working-directory/corpus
-        # each file is treated as a separate document
-        # does NOT support subfolders in corpus directory right now
-        for subdir, dirs, files in os.walk(self.corpus_root):
-            self.documents = files
-        self.total_docs = len(self.documents)
+        # stage timers and counters, see instrumentation.Metrics
+        self.metrics = metrics if metrics is not None else NULL_METRICS
+
+        # each file under the corpus folder (subfolders included) is treated as a separate document,
+        # other sources (TIME style files, jsonl, archives) stream their documents without splitting them into files.
+        # Without either the index starts out empty and documents are added with add_documents
+        if source is None:
+            source = DirectorySource(corpus_root) if corpus_root is not None else []
+        self.source = source
+        self.documents = self.source.paths() if isinstance(self.source, DirectorySource) else None
+        self.total_docs = len(self.documents) if self.documents is not None else 0
 
-        self.stemmer = nltk.PorterStemmer()
-        self.stop_words = nltk.corpus.stopwords.words('english')
+        # the analyzer can be shared with a QueryEngine so both process text the same way
+        self.analyzer = analyzer if analyzer is not None else TextAnalyzer()
 
         self.inverted_index = {}    # {term: [doc_freq, total_freq, postings_list]}
         self.doc_map = {}           # {doc_id : [artist/song, doc_vector_length]}
         self.weighted_index = {}    # same as inverted index except instead of raw count in postings, there are weighted frequencies
+        self.weighting_scheme = None    # the weighting.WeightingScheme the weighted index was calculated with
+
+        # state for adding and deleting documents incrementally
+        self.doc_stats = {}         # {doc_id: [sum tf^2, sum tf^2 * log(df), sum tf^2 * log(df)^2]} used to update tf-idf doc lengths
+        self.deleted_docs = set()   # doc ids that are deleted but still have postings in the index
+        self.max_doc_id = None
 
-    def create_inverted_index(self):
+    def create_inverted_index(self, num_workers=1, chunk_size=64):
         """
         Returns a inverted index with raw term counts as weights in the postings list
+        With num_workers > 1 the documents are tokenized in parallel by a pool of processes
         """
+        if num_workers > 1:
+            return self.create_inverted_index_parallel(num_workers, chunk_size)
+
         all_tokens = {}
-        for i, filename in enumerate(self.documents):
-            self.doc_map[i+1] = [filename.split('.')[0], 0]
-            tokens = self.tokenize_document(filename)
-            all_tokens[i+1] = tokens
+        with self.metrics.timer('tokenize'):
+            for i, (doc_name, text) in enumerate(self.source):
+                self.doc_map[i+1] = [doc_name, 0]
+                tokens = self.tokenize_text(text)
+                all_tokens[i+1] = tokens
+        self.total_docs = len(all_tokens)
+        self.metrics.incr('documents_indexed', len(all_tokens))
             
-        compiled_list = self.combine_document_tokens(all_tokens)
-        self.inverted_index = self.merge_tokens(compiled_list)
+        with self.metrics.timer('combine_tokens'):
+            compiled_list = self.combine_document_tokens(all_tokens)
+        with self.metrics.timer('merge_tokens'):
+            self.inverted_index = self.merge_tokens(compiled_list)
+        self.metrics.incr('postings_indexed', len(compiled_list))
+        return self.inverted_index
+
+    def create_inverted_index_parallel(self, num_workers=None, chunk_size=64):
+        """
+        Builds the same inverted index as create_inverted_index but spreads the documents across a process pool.
+        Doc ids are assigned up front so they are the same as in a serial build,
+        each worker builds a partial index for a contiguous range of doc ids and the partial indexes are merged in order
+        """
+        if num_workers is None:
+            num_workers = os.cpu_count() or 1
+
+        with self.metrics.timer('parallel_build'), \
+                multiprocessing.Pool(num_workers, initializer=_init_worker, initargs=(self.analyzer.stemming,)) as pool:
+            # imap hands back the partial indexes in chunk order, which keeps the postings sorted by doc id
+            partial_indexes = pool.imap(_index_chunk, self.document_chunks(chunk_size))
+            self.inverted_index = self.merge_partial_indexes(partial_indexes)
+        self.total_docs = len(self.doc_map)
+        self.metrics.incr('documents_indexed', len(self.doc_map))
         return self.inverted_index
 
+    def document_chunks(self, chunk_size):
+        """
+        Reads the source and yields chunks of (doc_id, text) for the workers, filling in the document mapping on the way
+        """
+        chunk = []
+        for i, (doc_name, text) in enumerate(self.source):
+            self.doc_map[i+1] = [doc_name, 0]
+            chunk.append((i+1, text))
+            if len(chunk) == chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def merge_partial_indexes(self, partial_indexes):
+        """
+        Reduces partial inverted indexes built over increasing, non overlapping doc id ranges into a single inverted index
+        """
+        merged_dict = {}
+        for partial_index in partial_indexes:
+            for term, (doc_freq, total_freq, postings) in partial_index.items():
+                if term in merged_dict:
+                    merged_dict[term][0] += doc_freq
+                    merged_dict[term][1] += total_freq
+                    merged_dict[term][2].extend(postings)
+                else:
+                    merged_dict[term] = [doc_freq, total_freq, postings]
+
+        # keep the terms in sorted order like merge_tokens does
+        return {term: merged_dict[term] for term in sorted(merged_dict)}
+
+    def create_inverted_index_on_disk(self, raw_index_file, weighted_index_file=None, memory_budget=64 * 1024 * 1024, temp_dir=None,
+                                      max_fan_in=MAX_FAN_IN):
+        """
+        Builds the index out of core for corpora larger than memory and streams it to json files instead of keeping it in memory.
+        Peak memory is bounded by memory_budget (in bytes) and open run files by max_fan_in, see SpimiIndexBuilder
+        """
+        builder = SpimiIndexBuilder(self, memory_budget=memory_budget, temp_dir=temp_dir, max_fan_in=max_fan_in)
+        return builder.build(raw_index_file, weighted_index_file)
+
+    def create_positional_index(self):
+        """
+        Returns a PositionalIndex of the corpus for phrase and proximity queries, with the same doc ids as create_inverted_index
+        """
+        positional_index = PositionalIndex(self.analyzer)
+        with self.metrics.timer('positional_index'):
+            for i, (doc_name, text) in enumerate(self.source):
+                positional_index.add_document(i+1, (text,))
+        return positional_index
+
+    def create_impact_index(self, bits=8):
+        """
+        Builds the impact ordered index (see impact_index.ImpactIndex) from the weighted index and the document vector lengths,
+        which are calculated first if they have not been
+        """
+        check_bits(bits)
+        if not self.weighted_index:
+            self.calculate_weighted_index()
+        # the lengths start out as 0 and calculate_weighted_index does not set them, without them every impact would be dropped
+        if any(values[1] == 0 for values in self.doc_map.values()):
+            self.calculate_document_vector_lengths()
+        with self.metrics.timer('impact_index'):
+            return ImpactIndex.build(self.weighted_index, self.doc_map, bits)
+
     def tokenize_document(self, filename):
         """
         Helper method that proccesses a single document.
@@ -50,23 +172,22 @@ class InvertedIndex:
         Removes non ascii words
         Performs stemming
         """
-        token_dict = {}
-        with open(self.corpus_root + '/' + filename, 'r', encoding='latin1') as f:
-            for line in f:
-                # remove puncuation
-                line = line.translate(str.maketrans('', '', string.punctuation))
-                words = [word.strip().lower() for word in line.split()]
+        doc_name, text = self.directory_source().read(filename)
+        return self.tokenize_text(text)
 
-                for word in words:
-                    # get rid of the word if it has any non-ascii characters or it is a stop word
-                    if word not in self.stop_words and all(ord(char) < 128 for char in word):
-                        stem = self.stemmer.stem(word) # uses porter stemmer
-                        if stem in token_dict:
-                            token_dict[stem] += 1
-                        else:
-                            token_dict[stem] = 1
+    def directory_source(self):
+        """
+        Returns the source of an index built from a corpus folder, the filename helpers only work for those
+        """
+        if not isinstance(self.source, DirectorySource):
+            raise ValueError('documents can only be read by filename from an index built from a corpus folder, pass (doc_name, text) pairs instead')
+        return self.source
 
-        return token_dict
+    def tokenize_text(self, text):
+        """
+        Same as tokenize_document for the text of a document read from a corpus source
+        """
+        return self.analyzer.count_terms((text,))
 
     def combine_document_tokens(self, tokens_dict):
         """
@@ -99,50 +220,224 @@ class InvertedIndex:
 
     def calculate_weighted_index(self, method='tf_idf'):
         """
-        Weights the terms of the inverted index based on the selected method
+        Weights the terms of the inverted index based on the selected method, any scheme in weighting.SCHEMES
         """
         # create the inverted index if it doesn't exist yet
         if not self.inverted_index:
             self.create_inverted_index()
+        if self.deleted_docs:
+            self.purge_deleted_documents()
 
-        self.weighted_index = copy.deepcopy(self.inverted_index)
-        if method == 'tf_idf':
-            for term, values in self.weighted_index.items():
+        # the weighted postings are built directly from the raw counts instead of deep copying the index first.
+        # QueryEngine(raw_index_file, doc_mapping_file, weighting=method) applies the same weights at query time without a weighted copy at all
+        with self.metrics.timer('weighting'):
+            scheme = get_scheme(method)
+            scheme.prepare(self.total_docs, document_token_counts(self.inverted_index, self.doc_map))
+            self.weighting_scheme = scheme
+            self.weighted_index = {}
+            for term, values in self.inverted_index.items():
                 doc_freq = values[0]
                 total_freq = values[1]
                 postings = values[2]
 
-                idf = math.log(self.total_docs / doc_freq, 2)
-
-                for posting in postings:
-                    posting[1] *= idf
+                idf = scheme.idf(doc_freq)
+                self.weighted_index[term] = [doc_freq, total_freq, [[doc_id, scheme.weight(freq, idf, doc_id)] for doc_id, freq in postings]]
         
         return self.weighted_index
 
     def calculate_document_vector_lengths(self, inverted_index=None):
         """
-        Calculates the norm of the doc vector based off the weights of a given inverted index
+        Calculates the norm of the doc vector based off the weights of a given inverted index.
+        For the weighted index the normalizer of its weighting scheme is used instead (pivoted length, 1 for bm25),
+        so an exported index ranks like QueryEngine(raw index, weighting=method)
         """
         # use the weighted index by default
         if inverted_index == None:
             inverted_index = self.weighted_index
+            if self.weighting_scheme is not None:
+                with self.metrics.timer('doc_lengths'):
+                    norms = self.weighting_scheme.doc_norms(([posting[0] for posting in values[2]], [posting[1] for posting in values[2]])
+                                                            for values in inverted_index.values())
+                    for doc_index, values in self.doc_map.items():
+                        values[1] = norms[doc_index]
+                return self.doc_map
 
-        # initialize the doc lengths for each document as 0
-        for doc_index, values in self.doc_map.items():
-            values[1] = 0
+        with self.metrics.timer('doc_lengths'):
+            # initialize the doc lengths for each document as 0
+            for doc_index, values in self.doc_map.items():
+                values[1] = 0
 
-        # loop through all the postings list and keep a running sum of the squared weighted frequency for each document
-        for term, values in inverted_index.items():
-            postings = values[2]
-            for doc_index, weight in postings:
-                self.doc_map[doc_index][1] += weight**2
+            # loop through all the postings list and keep a running sum of the squared weighted frequency for each document
+            for term, values in inverted_index.items():
+                postings = values[2]
+                for doc_index, weight in postings:
+                    self.doc_map[doc_index][1] += weight**2
 
-        # after all the weights are summed, take the square root for each document to get the final vector length
-        for doc_index, values in self.doc_map.items():
-            values[1] = math.sqrt(values[1])
+            # after all the weights are summed, take the square root for each document to get the final vector length
+            for doc_index, values in self.doc_map.items():
+                values[1] = math.sqrt(values[1])
 
         return self.doc_map
 
+    def load_exported_index(self, inverted_index_file, doc_mapping_file):
+        """
+        Loads a previously exported raw count index and document mapping so documents can be added, replaced or deleted
+        without reindexing the whole corpus
+        """
+        with open(inverted_index_file) as f:
+            self.inverted_index = json.load(f)
+        with open(doc_mapping_file) as f:
+            self.doc_map = {int(doc_id): values for doc_id, values in json.load(f).items()}
+
+        self.total_docs = len(self.doc_map)
+        self.weighted_index = {}
+        self.doc_stats = {}
+        self.deleted_docs = set()
+        self.max_doc_id = None
+        return self.inverted_index
+
+    def add_documents(self, documents):
+        """
+        Adds documents given as (doc_name, text) pairs (e.g. from a corpus source) to the existing index and returns their doc ids.
+        The new documents are indexed as a small segment and merged into the main index,
+        so the cost depends on the new documents and the postings of their terms rather than on the whole corpus
+        """
+        self.build_doc_stats()
+        if self.max_doc_id is None:
+            self.max_doc_id = max(list(self.doc_map) + list(self.deleted_docs), default=0)
+
+        segment_tokens = {}
+        for doc_name, text in documents:
+            self.max_doc_id += 1
+            self.doc_map[self.max_doc_id] = [doc_name, 0]
+            segment_tokens[self.max_doc_id] = self.tokenize_text(text)
+
+        segment = self.merge_tokens(self.combine_document_tokens(segment_tokens))
+        self.merge_segment(segment)
+        self.total_docs += len(segment_tokens)
+        return list(segment_tokens)
+
+    def add_document(self, doc_name, text):
+        return self.add_documents([(doc_name, text)])[0]
+
+    def add_files(self, filenames):
+        """
+        Adds files from the corpus folder (paths relative to it) to the existing index and returns their doc ids
+        """
+        source = self.directory_source()
+        return self.add_documents(source.read(filename) for filename in filenames)
+
+    def delete_document(self, doc_id):
+        """
+        Deletes a document from the index.
+        The document is dropped from the document mapping right away but its postings are only removed
+        the next time the index is weighted or exported, see purge_deleted_documents
+        """
+        doc_id = int(doc_id)
+        del self.doc_map[doc_id]
+        self.doc_stats.pop(doc_id, None)
+        self.deleted_docs.add(doc_id)
+        self.total_docs -= 1
+
+    def update_document(self, doc_id, doc_name, text):
+        """
+        Replaces a document with a new version, the new version gets a new doc id which is returned
+        """
+        self.delete_document(doc_id)
+        return self.add_document(doc_name, text)
+
+    def update_file(self, doc_id, filename):
+        """
+        Replaces a document with the current contents of a file in the corpus folder
+        """
+        doc_name, text = self.directory_source().read(filename)
+        return self.update_document(doc_id, doc_name, text)
+
+    def merge_segment(self, segment):
+        """
+        Merges a segment (an inverted index over doc ids that are all larger than the ones in the main index) into the main index.
+        Appending keeps the postings sorted by doc id. Only the doc stats of documents that share a term with the segment change
+        """
+        for term, (doc_freq, total_freq, postings) in segment.items():
+            if term in self.inverted_index:
+                values = self.inverted_index[term]
+                old_log_df = math.log(values[0], 2)
+                new_log_df = math.log(values[0] + doc_freq, 2)
+                for doc_id, freq in values[2]:
+                    stats = self.doc_stats.get(doc_id)
+                    if stats is not None:
+                        stats[1] += freq**2 * (new_log_df - old_log_df)
+                        stats[2] += freq**2 * (new_log_df**2 - old_log_df**2)
+
+                values[0] += doc_freq
+                values[1] += total_freq
+                values[2].extend(postings)
+            else:
+                self.inverted_index[term] = [doc_freq, total_freq, postings]
+
+            log_df = math.log(self.inverted_index[term][0], 2)
+            for doc_id, freq in postings:
+                stats = self.doc_stats.setdefault(doc_id, [0, 0, 0])
+                stats[0] += freq**2
+                stats[1] += freq**2 * log_df
+                stats[2] += freq**2 * log_df**2
+
+    def purge_deleted_documents(self):
+        """
+        Removes the postings of deleted documents from the index and updates the term statistics
+        """
+        for term in list(self.inverted_index):
+            values = self.inverted_index[term]
+            postings = [posting for posting in values[2] if posting[0] not in self.deleted_docs]
+            if not postings:
+                del self.inverted_index[term]
+            elif len(postings) != len(values[2]):
+                values[0] = len(postings)
+                values[1] = sum(freq for doc_id, freq in postings)
+                values[2] = postings
+        self.deleted_docs = set()
+
+        # document frequencies changed so the doc stats are rebuilt the next time they are needed
+        self.doc_stats = {}
+
+    def build_doc_stats(self):
+        """
+        Computes the per document statistics used to keep the tf-idf doc vector lengths up to date incrementally
+        """
+        if self.doc_stats or not self.doc_map:
+            return self.doc_stats
+        if self.deleted_docs:
+            self.purge_deleted_documents()
+
+        for doc_id in self.doc_map:
+            self.doc_stats[doc_id] = [0, 0, 0]
+        for term, values in self.inverted_index.items():
+            log_df = math.log(values[0], 2)
+            for doc_id, freq in values[2]:
+                stats = self.doc_stats[doc_id]
+                stats[0] += freq**2
+                stats[1] += freq**2 * log_df
+                stats[2] += freq**2 * log_df**2
+        return self.doc_stats
+
+    def update_document_vector_lengths(self):
+        """
+        Updates the tf-idf doc vector lengths from the doc stats instead of from the weighted index.
+        With w = tf * (log(N) - log(df)) the squared length of a document is
+        log(N)^2 * sum tf^2 - 2 * log(N) * sum tf^2 log(df) + sum tf^2 log(df)^2,
+        so a change in the number of documents only costs one pass over the documents.
+        Pending deletes are purged first since they change the document frequencies
+        """
+        if self.deleted_docs:
+            self.purge_deleted_documents()
+        self.build_doc_stats()
+        log_total = math.log(self.total_docs, 2)
+        for doc_id, values in self.doc_map.items():
+            sum_sq, sum_sq_log, sum_sq_log_sq = self.doc_stats[doc_id]
+            # clamp the rounding error for documents whose terms all have an idf of zero
+            values[1] = math.sqrt(max(log_total**2 * sum_sq - 2 * log_total * sum_sq_log + sum_sq_log_sq, 0))
+        return self.doc_map
+
     def print_index(self):
         """
         Prints the inverted index in a more readable format showing the term, document frequency, total frequency and the postings list
@@ -155,16 +450,54 @@ class InvertedIndex:
             print(format_template.format(k, v[0], v[1], postings_list))
 
     def export_inverted_index(self, filename):
-        with open(filename, 'w') as f:
-            json.dump(self.inverted_index, f)
+        if self.deleted_docs:
+            self.purge_deleted_documents()
+        write_json(filename, self.inverted_index)
 
     def export_weighted_index(self, filename):
-        with open(filename, 'w') as f:
-            json.dump(self.weighted_index, f)
+        write_json(filename, self.weighted_index)
 
     def export_document_mapping(self, filename):
-        with open(filename, 'w') as f:
-            json.dump(self.doc_map, f)
+        write_json(filename, self.doc_map)
+
+    def export_binary_index(self, filename, weighted=True, weight_bits=None):
+        """
+        Exports the weighted (or raw count) index together with the document mapping as a single binary file
+        that QueryEngine can memory map instead of parsing.
+        Set weight_bits (e.g. 8) to compress the postings, the weights are then quantized to that many bits
+        """
+        index = self.weighted_index if weighted else self.inverted_index
+        write_binary_index(filename, index, self.doc_map, weight_bits=weight_bits)
+
+    def export_impact_index(self, filename, bits=8):
+        self.create_impact_index(bits).save(filename)
+
+    def export_shards(self, file_prefix, num_shards, method='hash', weight_bits=None):
+        """
+        Splits the raw count index into num_shards document partitioned binary index files for ShardedQueryEngine.
+        method='hash' splits by doc id, method='artist' keeps the songs of an artist in the same shard.
+        Every shard is weighted with the idf of the whole collection
+        """
+        if not self.inverted_index:
+            self.create_inverted_index()
+        if self.deleted_docs:
+            self.purge_deleted_documents()
+        return export_shards(self.inverted_index, self.doc_map, file_prefix, num_shards, method, weight_bits)
+
+# worker process state for the parallel build, each worker keeps its own analyzer
+_worker_index = None
+
+def _init_worker(stemming=True):
+    global _worker_index
+    _worker_index = InvertedIndex(analyzer=TextAnalyzer(stemming=stemming), source=[])
+
+def _index_chunk(chunk):
+    """
+    Builds the partial inverted index for a chunk of (doc_id, text) pairs
+    """
+    all_tokens = {doc_id: _worker_index.tokenize_text(text) for doc_id, text in chunk}
+    compiled_list = _worker_index.combine_document_tokens(all_tokens)
+    return _worker_index.merge_tokens(compiled_list)
 
 # for testing          
 if __name__ == '__main__':         
@@ -0,0 +1,215 @@
+import os
+import json
+import math
+import time
+import shutil
+import argparse
+import tempfile
+import itertools
+import multiprocessing
+from create_inverted_index import InvertedIndex
+from corpus_sources import open_corpus
+from run_query import QueryEngine
+from text_analyzer import TextAnalyzer
+from weighting import SCHEMES
+from benchmark import percentiles
+
+
+def load_queries(queries_file):
+    """
+    Returns {query_id: query text} from a TIME.QUE style file where every query starts with '*FIND <query_id>'
+    """
+    queries = {}
+    query_id = None
+    with open(queries_file) as f:
+        for line in f:
+            if line.startswith('*FIND'):
+                query_id = line.split()[-1]
+                queries[query_id] = ''
+            elif line.startswith('*STOP'):
+                break
+            elif query_id is not None:
+                queries[query_id] += line
+    return queries
+
+
+def load_relevance(relevance_file):
+    """
+    Returns {query_id: set of relevant doc numbers} from a TIME.REL style file with lines '<query_id> <doc number> ...'
+    """
+    relevance = {}
+    with open(relevance_file) as f:
+        for line in f:
+            split = line.split()
+            if split:
+                relevance[split[0]] = set(str(int(doc_number)) for doc_number in split[1:])
+    return relevance
+
+
+def doc_number(doc_name):
+    """
+    The TIME article number of a document named like create_corpus_from_test_data.py names them (text_017 -> 17)
+    """
+    number = doc_name.rsplit('_', 1)[-1]
+    return str(int(number)) if number.isdigit() else number
+
+
+def precision_at_k(ranked, relevant, k):
+    return sum(1 for doc in ranked[:k] if doc in relevant) / k
+
+
+def recall_at_k(ranked, relevant, k):
+    return sum(1 for doc in ranked[:k] if doc in relevant) / len(relevant) if relevant else 0
+
+
+def average_precision(ranked, relevant):
+    """
+    Mean of the precision at the rank of every relevant document, relevant documents that are not retrieved count as zero
+    """
+    if not relevant:
+        return 0
+    hits = 0
+    total = 0
+    for rank, doc in enumerate(ranked, 1):
+        if doc in relevant:
+            hits += 1
+            total += hits / rank
+    return total / len(relevant)
+
+
+def ndcg_at_k(ranked, relevant, k):
+    """
+    nDCG with binary relevance
+    """
+    dcg = sum(1 / math.log2(rank + 1) for rank, doc in enumerate(ranked[:k], 1) if doc in relevant)
+    ideal = sum(1 / math.log2(rank + 1) for rank in range(1, min(len(relevant), k) + 1))
+    return dcg / ideal if ideal else 0
+
+
+def build_index(corpus_root, stemming, index_file):
+    """
+    Builds the raw count index of a corpus (folder, TIME.ALL style file, jsonl or archive) with stemming on or off
+    and writes it as a binary index
+    """
+    index = InvertedIndex(source=open_corpus(corpus_root), analyzer=TextAnalyzer(stemming=stemming))
+    index.create_inverted_index()
+    index.export_binary_index(index_file, weighted=False)
+    return index_file
+
+
+# test collection of a worker process, loaded once by the pool initializer
+_queries = None
+_relevance = None
+
+
+def _init_worker(queries, relevance):
+    global _queries, _relevance
+    _queries = queries
+    _relevance = relevance
+
+
+def evaluate_config(index_file, doc_mapping_file, stemming, weighting, ks, depth=1000):
+    """
+    Runs every query against a raw count index weighted with one scheme and returns MAP, P@k, R@k and nDCG@k for every k
+    together with the query latencies. The ranking is retrieved once up to depth and cut off at every k
+    """
+    engine = QueryEngine(index_file, doc_mapping_file, analyzer=TextAnalyzer(stemming=stemming), cache_size=0, weighting=weighting)
+
+    rankings = {}
+    latencies = []
+    for query_id, query in _queries.items():
+        start = time.perf_counter()
+        results = engine.query(query, num_results=depth, print_results=False)
+        latencies.append(time.perf_counter() - start)
+        rankings[query_id] = [doc_number(engine.doc_mapping[doc_id][0]) for doc_id, score in results if score > 0]
+    engine.close()
+
+    judged = [query_id for query_id in rankings if query_id in _relevance]
+    results = []
+    for k in ks:
+        results.append({
+            'stemming': stemming,
+            'weighting': weighting,
+            'k': k,
+            'map': sum(average_precision(rankings[q], _relevance[q]) for q in judged) / len(judged) if judged else 0,
+            'precision': sum(precision_at_k(rankings[q], _relevance[q], k) for q in judged) / len(judged) if judged else 0,
+            'recall': sum(recall_at_k(rankings[q], _relevance[q], k) for q in judged) / len(judged) if judged else 0,
+            'ndcg': sum(ndcg_at_k(rankings[q], _relevance[q], k) for q in judged) / len(judged) if judged else 0,
+            'latency': percentiles(latencies),
+        })
+    return results
+
+
+def _evaluate_config(args):
+    return evaluate_config(*args)
+
+
+def run_sweep(queries, relevance, corpus_root=None, index_file=None, doc_mapping_file=None,
+              weightings=tuple(SCHEMES), stemmings=(True, False), ks=(10,), num_workers=None):
+    """
+    Evaluates every (stemming, weighting) configuration across a pool of processes.
+    The index of every stemming setting is built once (or a prebuilt raw count index is used, which has to be stemmed)
+    and shared by all the weighting schemes, which weight it at query time
+    """
+    temp_dir = tempfile.mkdtemp(prefix='evaluation_')
+    try:
+        with multiprocessing.Pool(num_workers, initializer=_init_worker, initargs=(queries, relevance)) as pool:
+            if index_file is not None:
+                indexes = {True: index_file}
+            else:
+                builds = {stemming: pool.apply_async(build_index, (corpus_root, stemming, os.path.join(temp_dir, f'stemming_{stemming}.idx')))
+                          for stemming in stemmings}
+                indexes = {stemming: build.get() for stemming, build in builds.items()}
+                doc_mapping_file = None
+
+            configs = [(indexes[stemming], doc_mapping_file, stemming, weighting, list(ks))
+                       for stemming, weighting in itertools.product(stemmings, weightings) if stemming in indexes]
+            return [result for results in pool.imap(_evaluate_config, configs) for result in results]
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+def print_report(results):
+    format_template = "{:10}|{:^12}|{:^5}|{:^8}|{:^8}|{:^8}|{:^8}|{:^10}"
+    print(format_template.format('Weighting', 'Stemming', 'k', 'MAP', 'P@k', 'R@k', 'nDCG@k', 'p50 ms'))
+    print('='*80)
+    for result in sorted(results, key=lambda x: -x['map']):
+        print(format_template.format(result['weighting'], str(result['stemming']), result['k'], f'{result["map"]:.4f}',
+                                     f'{result["precision"]:.4f}', f'{result["recall"]:.4f}', f'{result["ndcg"]:.4f}',
+                                     f'{result["latency"]["p50_ms"]:.2f}'))
+
+
+# python evaluation.py --corpus corpus_time_test --k 5 10 20
+# python evaluation.py --corpus test_data/TIME.ALL (reads the articles straight from the collection file)
+# python evaluation.py --index time_test_raw_count_index.json --doc-mapping time_test_document_mapping.json
+def main():
+    parser = argparse.ArgumentParser(description='Evaluates weighting / stemming / k configurations on the TIME test collection')
+    parser.add_argument('--queries', default='test_data/TIME.QUE')
+    parser.add_argument('--relevance', default='test_data/TIME.REL')
+    parser.add_argument('--corpus', default='corpus_time_test', help='corpus folder with one file per article, or a TIME.ALL style file, jsonl file or archive')
+    parser.add_argument('--index', default=None, help='prebuilt (stemmed) raw count index to use instead of building from the corpus')
+    parser.add_argument('--doc-mapping', default=None)
+    parser.add_argument('--weighting', nargs='*', default=list(SCHEMES), choices=list(SCHEMES))
+    parser.add_argument('--stemming', nargs='*', default=['on', 'off'], choices=['on', 'off'])
+    parser.add_argument('--k', nargs='*', type=int, default=[10])
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--output', default=None, help='json file to write the results to')
+    args = parser.parse_args()
+
+    queries = load_queries(args.queries)
+    relevance = load_relevance(args.relevance)
+    stemmings = [stemming == 'on' for stemming in args.stemming]
+
+    start = time.perf_counter()
+    results = run_sweep(queries, relevance, corpus_root=os.path.abspath(args.corpus), index_file=args.index, doc_mapping_file=args.doc_mapping,
+                        weightings=args.weighting, stemmings=stemmings, ks=args.k, num_workers=args.workers)
+    print_report(results)
+    print(f'{len(results)} configurations in {time.perf_counter() - start:.2f}s')
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
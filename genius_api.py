@@ -1,20 +1,77 @@
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from bs4 import BeautifulSoup
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import threading
 import string
+import json
+import time
 import os
 import sys
 import re
 
+class TokenBucket:
+    """
+    Thread safe token bucket rate limiter, allows bursts of up to capacity requests and rate requests per second on average
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1, rate)
+        self.tokens = self.capacity
+        self.last_refill = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Blocks until a token is available and takes it
+        """
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.last_refill) * self.rate)
+                self.last_refill = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
 class GeniusApi:
 
-    def __init__(self, access_token):
-        self.base_url = 'https://api.genius.com'
+    def __init__(self, access_token, base_url='https://api.genius.com', pool_size=10, max_retries=3, backoff_factor=0.5,
+                 requests_per_second=None, timeout=30):
+        self.base_url = base_url
         self.headers = {
             'Authorization': f'Bearer {access_token}'
         }
         self.script_path = os.path.dirname(os.path.realpath(__file__))
+        self.timeout = timeout
+
+        # one pooled session for every request so connections are reused,
+        # failed requests and 429/5xx responses are retried with exponential backoff
+        retry = Retry(total=max_retries, backoff_factor=backoff_factor, status_forcelist=[429, 500, 502, 503, 504],
+                      allowed_methods=['GET'])
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self.rate_limiter = TokenBucket(requests_per_second) if requests_per_second else None
+        self.checkpoint_lock = threading.Lock()
         return
 
+    def get(self, url, **kwargs):
+        """
+        GET through the pooled session, waiting on the rate limiter first
+        """
+        if self.rate_limiter:
+            self.rate_limiter.acquire()
+        r = self.session.get(url, timeout=self.timeout, **kwargs)
+        r.raise_for_status()
+        return r
+
     def get_songs_for_all_artists(self, artist_list, num_songs=20, sort='popularity', out_folder='songs'):
         """
         Loops through the artist list and gets the lyrics for n most popular songs
@@ -23,6 +80,94 @@ class GeniusApi:
             self.get_artist_songs(artist, num_songs, sort, out_folder=out_folder)
         return
 
+    def crawl_all_artists(self, artist_list, num_songs=20, sort='popularity', out_folder='songs', max_workers=8,
+                          checkpoint_file=None):
+        """
+        Concurrent version of get_songs_for_all_artists.
+        Artists and lyric pages are fetched by a pool of threads sharing the pooled session and rate limiter.
+        Progress is saved to checkpoint_file after every song, so running it again after an interruption
+        only fetches what is missing. Returns the number of artists and songs that failed and will be retried on the next run
+        """
+        checkpoint = self.load_checkpoint(checkpoint_file)
+        failed = 0
+
+        # find the songs of every artist that has not been listed yet
+        missing_artists = [artist for artist in artist_list if artist not in checkpoint['artists']]
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {executor.submit(self.list_artist_songs, artist, num_songs, sort): artist for artist in missing_artists}
+            for future in as_completed(futures):
+                artist = futures[future]
+                try:
+                    songs = future.result()
+                except Exception as e:
+                    print(f'Failed to list songs for {artist}: {e}', file=sys.stderr)
+                    failed += 1
+                    continue
+                with self.checkpoint_lock:
+                    checkpoint['artists'][artist] = songs
+                    self.save_checkpoint(checkpoint, checkpoint_file)
+
+        # then download the lyrics of every song that is not done yet
+        done = set(checkpoint['done_songs'])
+        pending = [(artist, song) for artist in artist_list for song in checkpoint['artists'].get(artist, [])
+                   if song['id'] not in done]
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {executor.submit(self.download_song, artist, song, out_folder): song for artist, song in pending}
+            for future in as_completed(futures):
+                song = futures[future]
+                try:
+                    future.result()
+                except Exception as e:
+                    print(f'Failed to download {song["url"]}: {e}', file=sys.stderr)
+                    failed += 1
+                    continue
+                with self.checkpoint_lock:
+                    checkpoint['done_songs'].append(song['id'])
+                    self.save_checkpoint(checkpoint, checkpoint_file)
+
+        return failed
+
+    def list_artist_songs(self, artist_name, num_songs=20, sort='popularity'):
+        """
+        Returns the id, title and url of the top n songs where the artist is the primary artist
+        """
+        artist_id = self.get_artist_id(artist_name)
+        endpoint = f'/artists/{artist_id}/songs'
+        params = {
+            'sort': sort,
+            'per_page': num_songs
+        }
+        r = self.get(self.base_url + endpoint, params=params, headers=self.headers)
+
+        songs = []
+        for song_details in r.json()['response']['songs']:
+            if song_details['primary_artist']['id'] == artist_id:
+                title = song_details['title']
+                title = title.translate(str.maketrans('', '', string.punctuation)) # remove puncuation
+                songs.append({'id': song_details['id'], 'title': title, 'url': song_details['url']})
+        return songs
+
+    def download_song(self, artist_name, song, out_folder='songs'):
+        song_text = self.get_song_text(song['url'])
+        self.create_lyric_file(artist_name, song['title'], song_text, out_folder=out_folder)
+
+    def load_checkpoint(self, checkpoint_file):
+        """
+        Checkpoint format: {"artists": {artist_name: [song, ...]}, "done_songs": [song_id, ...]}
+        """
+        if checkpoint_file and os.path.exists(checkpoint_file):
+            with open(checkpoint_file) as f:
+                return json.load(f)
+        return {'artists': {}, 'done_songs': []}
+
+    def save_checkpoint(self, checkpoint, checkpoint_file):
+        if not checkpoint_file:
+            return
+        # write then rename so an interrupted save never leaves a broken checkpoint behind
+        with open(checkpoint_file + '.tmp', 'w') as f:
+            json.dump(checkpoint, f)
+        os.replace(checkpoint_file + '.tmp', checkpoint_file)
+
     def get_artist_songs(self, artist_name, num_songs=20, sort='popularity', out_folder='songs'):
         """
         Uses the Genius API to get the top n songs for an artist
@@ -34,7 +179,7 @@ class GeniusApi:
             'sort': sort,
             'per_page': num_songs
         }
-        r = requests.get(self.base_url + endpoint, params=params, headers=self.headers)
+        r = self.get(self.base_url + endpoint, params=params, headers=self.headers)
 
         # loop through the songs and extract the title and song id
         for song_details in r.json()['response']['songs']:
@@ -51,12 +196,12 @@ class GeniusApi:
         params = {
             'q': artist_name
         }
-        r = requests.get(self.base_url + endpoint, params=params, headers=self.headers)
+        r = self.get(self.base_url + endpoint, params=params, headers=self.headers)
         artist_id = r.json()['response']['hits'][0]['result']['primary_artist']['id']
         return artist_id
 
     def get_song_text(self, url):
-        lyric_page = requests.get(url)
+        lyric_page = self.get(url)
         html = BeautifulSoup(lyric_page.text, 'html.parser')
 
         lyrics = html.find('div', class_='lyrics').get_text()
@@ -71,8 +216,7 @@ class GeniusApi:
         if filename == 'auto':
             filename = f'{artist_name}_{song_title}.txt'
 
-        if not os.path.exists(out_folder_path):
-            os.makedirs(out_folder_path)
+        os.makedirs(out_folder_path, exist_ok=True)
 
         with open(os.path.join(out_folder_path, filename), 'wb') as f:
             f.write(song_text.encode('utf-8'))
@@ -0,0 +1,164 @@
+import os
+import time
+import struct
+from array import array
+
+MAGIC = b'IRIM'
+VERSION = 1
+
+# magic, version, impact bits, number of terms, impact scale
+HEADER = struct.Struct('<4sIIId')
+# term length, number of blocks, number of postings
+TERM_HEADER = struct.Struct('<III')
+
+# impact levels are stored as uint16
+MAX_BITS = 16
+
+
+def check_bits(bits):
+    if not 1 <= bits <= MAX_BITS:
+        raise ValueError(f'impact bits has to be between 1 and {MAX_BITS}, got {bits}')
+
+
+class ImpactIndex:
+    """
+    Impact ordered index for score-at-a-time query evaluation.
+    A posting holds the length normalized weight (weight / doc_vector_length) of a term in a document, the part of the cosine
+    similarity that does not depend on the query, quantized to bits bits against the largest impact of the whole index
+    so impacts of different terms are on the same scale. The postings of a term are grouped into blocks of equal impact
+    in decreasing impact order: {term: [levels, block_offsets, doc_ids]}, the doc ids of the i-th block (sorted) are
+    doc_ids[block_offsets[i]:block_offsets[i+1]] and each of them has an impact of levels[i] * scale / (2^bits - 1)
+    """
+
+    def __init__(self, bits=8, scale=0):
+        self.bits = bits
+        self.scale = scale
+        self.postings = {}
+
+    @classmethod
+    def build(cls, weighted_index, doc_map, bits=8):
+        """
+        Builds the impact index from a weighted index {term: [doc_freq, total_freq, postings_list]}
+        and a document mapping {doc_id: [doc_name, doc_vector_length]} (e.g. InvertedIndex.weighted_index and doc_map)
+        """
+        check_bits(bits)
+        doc_lengths = {int(doc_id): values[1] for doc_id, values in doc_map.items()}
+        impacts = {}
+        scale = 0
+        for term, values in weighted_index.items():
+            term_impacts = []
+            for doc_id, weight in values[2]:
+                doc_length = doc_lengths[int(doc_id)]
+                if weight > 0 and doc_length:
+                    term_impacts.append((weight / doc_length, int(doc_id)))
+            if term_impacts:
+                impacts[term] = term_impacts
+                scale = max(scale, max(term_impacts)[0])
+
+        index = cls(bits, scale)
+        max_level = (1 << bits) - 1
+        for term, term_impacts in impacts.items():
+            # impacts too small for the first level still get it, so every document that has the term is scored
+            blocks = {}
+            for impact, doc_id in term_impacts:
+                blocks.setdefault(max(1, round(impact / scale * max_level)), []).append(doc_id)
+            levels = array('H')
+            block_offsets = array('I', [0])
+            doc_ids = array('I')
+            for level in sorted(blocks, reverse=True):
+                levels.append(level)
+                doc_ids.extend(sorted(blocks[level]))
+                block_offsets.append(len(doc_ids))
+            index.postings[term] = [levels, block_offsets, doc_ids]
+        return index
+
+    def impact(self, level):
+        return level * self.scale / ((1 << self.bits) - 1)
+
+    def __len__(self):
+        return len(self.postings)
+
+    def __contains__(self, term):
+        return term in self.postings
+
+    def top_k(self, term_counts, k, budget=None, time_budget=None):
+        """
+        Score-at-a-time evaluation. The blocks of all query terms are processed from the largest contribution
+        (impact level times the number of times the term is in the query) down, adding to one accumulator per document,
+        so the documents that matter most are scored first and the evaluation can stop at any point with a usable ranking.
+        budget bounds the number of postings processed and time_budget (in seconds) the time spent processing blocks.
+        The first block is always processed in full so there is a ranking to return, after it the budget is exact.
+        Returns ([(doc_id, accumulated level), ...] best first, number of postings processed, whether every block was processed)
+        """
+        blocks = []
+        for term, count in term_counts.items():
+            entry = self.postings.get(term)
+            if entry is None:
+                continue
+            levels, block_offsets, doc_ids = entry
+            for i, level in enumerate(levels):
+                blocks.append((level * count, doc_ids, block_offsets[i], block_offsets[i + 1]))
+        blocks.sort(key=lambda block: -block[0])
+
+        deadline = time.perf_counter() + time_budget if time_budget is not None else None
+        accumulators = {}
+        processed = 0
+        complete = True
+        for contribution, doc_ids, start, end in blocks:
+            if budget is not None and processed and processed + (end - start) > budget:
+                # the block is cut short where the budget runs out
+                end = start + max(0, budget - processed)
+                complete = False
+            elif deadline is not None and processed and time.perf_counter() > deadline:
+                complete = False
+                break
+            for i in range(start, end):
+                doc_id = doc_ids[i]
+                accumulators[doc_id] = accumulators.get(doc_id, 0) + contribution
+            processed += end - start
+            if not complete:
+                break
+
+        ranked = sorted(accumulators.items(), key=lambda x: (-x[1], x[0]))[:k]
+        return ranked, processed, complete
+
+    def save(self, filename):
+        """
+        Writes the index to a binary file, written to a temporary file first and moved in place
+        """
+        temp_filename = filename + '.tmp'
+        with open(temp_filename, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, VERSION, self.bits, len(self.postings), self.scale))
+            for term in sorted(self.postings):
+                levels, block_offsets, doc_ids = self.postings[term]
+                encoded = term.encode('utf-8')
+                f.write(TERM_HEADER.pack(len(encoded), len(levels), len(doc_ids)))
+                f.write(encoded)
+                f.write(levels.tobytes())
+                f.write(block_offsets.tobytes())
+                f.write(doc_ids.tobytes())
+        os.replace(temp_filename, filename)
+
+    @classmethod
+    def load(cls, filename):
+        with open(filename, 'rb') as f:
+            buffer = f.read()
+        magic, version, bits, num_terms, scale = HEADER.unpack_from(buffer, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f'{filename} is not a version {VERSION} impact index')
+
+        index = cls(bits, scale)
+        offset = HEADER.size
+        for i in range(num_terms):
+            term_length, num_blocks, num_postings = TERM_HEADER.unpack_from(buffer, offset)
+            offset += TERM_HEADER.size
+            term = buffer[offset:offset + term_length].decode('utf-8')
+            offset += term_length
+            entry = []
+            for typecode, length in (('H', num_blocks), ('I', num_blocks + 1), ('I', num_postings)):
+                values = array(typecode)
+                values.frombytes(buffer[offset:offset + values.itemsize * length])
+                offset += values.itemsize * length
+                entry.append(values)
+            index.postings[term] = entry
+        return index
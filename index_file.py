@@ -0,0 +1,395 @@
+import os
+import mmap
+import struct
+from array import array
+from postings_codec import (encode_vbyte, encode_doc_ids, decode_doc_ids, pack_bits, unpack_bits, packed_size,
+                            quantize_weights, dequantize_weights)
+
+# On-disk layout of a binary index file (all integers little-endian)
+#
+#   header        magic, version, weight bits, counts and section offsets
+#   block table   for every block of BLOCK_SIZE terms: where its dictionary entries and its first postings list start
+#   dictionary    the terms in sorted order (by utf-8 bytes), front coded within a block, each followed by
+#                 variable byte doc_freq, total_freq and postings size, the term's maximum length normalized weight
+#                 (top-k query evaluation uses it as a score upper bound) and, for compressed postings, the weight scale.
+#                 Compressed indexes store both as float32 (the score rounded up so it stays an upper bound) since with
+#                 8 bit weights two float64 per term are a large part of the file
+#   postings      for every term either doc_freq uint32 doc ids followed by doc_freq float64 weights
+#                 or, with weight_bits set, the weights quantized and bit packed followed by variable byte doc id gaps
+#   doc table     fixed width entries sorted by doc id
+#   doc strings   the utf-8 bytes of every document name, back to back
+#
+# A term is found with a binary search over the first terms of the blocks and a short scan inside one block,
+# directly on the mapped file. Nothing has to be parsed up front and only the pages touched by a query are read in.
+
+MAGIC = b'IRIX'
+VERSION = 4
+BLOCK_SIZE = 16
+
+HEADER = struct.Struct('<4sIIIIQQQQQ')  # magic, version, weight_bits, num_terms, num_docs, section offsets
+BLOCK_ENTRY = struct.Struct('<QQ')      # dictionary offset, postings offset of the first term in the block
+DOC_ENTRY = struct.Struct('<IQId')      # doc id, string offset, string length, doc vector length
+SCORE = struct.Struct('<d')
+SCORE32 = struct.Struct('<f')
+
+
+def is_binary_index(filename):
+    """
+    Checks the magic bytes at the start of a file to see if it is a binary index
+    """
+    with open(filename, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def write_binary_index(filename, inverted_index, doc_map, weight_bits=None):
+    """
+    Writes an inverted index {term: [doc_freq, total_freq, postings_list]} and a document mapping
+    {doc_id: [doc_name, doc_vector_length]} to a single binary index file.
+    With weight_bits the postings are compressed: doc ids are gap and variable byte encoded
+    and weights are quantized to weight_bits bits (see postings_codec)
+    """
+    terms = sorted((term.encode('utf-8'), term) for term in inverted_index)
+    docs = sorted((int(doc_id), values) for doc_id, values in doc_map.items())
+    doc_lengths = {doc_id: values[1] for doc_id, values in docs}
+
+    # lay out the variable length sections first so the fixed width tables can point into them
+    block_table = bytearray()
+    dictionary = bytearray()
+    postings = bytearray()
+    previous = b''
+    for i, (encoded, term) in enumerate(terms):
+        doc_freq, total_freq, postings_list = inverted_index[term]
+        doc_ids = [int(posting[0]) for posting in postings_list]
+        weights = [float(posting[1]) for posting in postings_list]
+
+        if weight_bits:
+            # the scale is stored as float32, quantize against the stored value so the weights read back are the ones written
+            scale, quantized = quantize_weights(weights, weight_bits, scale=to_float32(max(weights, default=0)))
+            weights = dequantize_weights(quantized, scale, weight_bits)
+            encoded_postings = pack_bits(quantized, weight_bits) + encode_doc_ids(doc_ids)
+        else:
+            scale = 0
+            encoded_postings = array('I', doc_ids).tobytes() + array('d', weights).tobytes()
+
+        # the upper bound has to hold for the weights as they are stored
+        max_score = max_normalized_weight(zip(doc_ids, weights), doc_lengths)
+
+        if i % BLOCK_SIZE == 0:
+            block_table += BLOCK_ENTRY.pack(len(dictionary), len(postings))
+            previous = b''
+        prefix = common_prefix_length(previous, encoded)
+        dictionary += encode_vbyte([prefix, len(encoded) - prefix]) + encoded[prefix:]
+        dictionary += encode_vbyte([len(postings_list), int(total_freq), len(encoded_postings)])
+        if weight_bits:
+            dictionary += SCORE32.pack(float32_upper_bound(max_score))
+            dictionary += SCORE32.pack(scale)
+        else:
+            dictionary += SCORE.pack(max_score)
+        postings += encoded_postings
+        previous = encoded
+
+    doc_strings = bytearray()
+    doc_table = bytearray()
+    for doc_id, (doc_name, doc_length) in docs:
+        encoded = doc_name.encode('utf-8')
+        doc_table += DOC_ENTRY.pack(doc_id, len(doc_strings), len(encoded), float(doc_length))
+        doc_strings += encoded
+
+    blocks_offset = HEADER.size
+    dictionary_offset = blocks_offset + len(block_table)
+    postings_offset = dictionary_offset + len(dictionary)
+    docs_offset = postings_offset + len(postings)
+    doc_strings_offset = docs_offset + len(doc_table)
+
+    # write to a temporary file and rename it over the old index so a QueryEngine that has the old file
+    # memory mapped keeps reading a complete index until it reloads
+    temp_filename = filename + '.tmp'
+    with open(temp_filename, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, weight_bits or 0, len(terms), len(docs), blocks_offset, dictionary_offset,
+                            postings_offset, docs_offset, doc_strings_offset))
+        for section in (block_table, dictionary, postings, doc_table, doc_strings):
+            f.write(section)
+    os.replace(temp_filename, filename)
+
+
+def to_float32(value):
+    return SCORE32.unpack(SCORE32.pack(value))[0]
+
+
+def float32_upper_bound(value):
+    """
+    Returns the smallest float32 that is >= value (value >= 0)
+    """
+    rounded = to_float32(value)
+    if rounded < value:
+        rounded = struct.unpack('<f', struct.pack('<I', struct.unpack('<I', SCORE32.pack(rounded))[0] + 1))[0]
+    return rounded
+
+
+def common_prefix_length(a, b):
+    n = min(len(a), len(b))
+    i = 0
+    while i < n and a[i] == b[i]:
+        i += 1
+    return i
+
+
+def max_normalized_weight(postings_list, doc_lengths):
+    """
+    Returns the largest weight / doc_vector_length in a postings list, doc_lengths is keyed by int doc id
+    """
+    max_score = 0
+    for doc_id, weight in postings_list:
+        doc_length = doc_lengths[int(doc_id)]
+        if doc_length:
+            max_score = max(max_score, weight / doc_length)
+    return max_score
+
+
+class BinaryIndex:
+    """
+    Read-only view of a binary index file through mmap.
+    Behaves like the {term: [doc_freq, total_freq, postings_list]} dict loaded from json
+    but only decodes the postings of the terms that are looked up
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._file = open(filename, 'rb')
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version = struct.unpack_from('<4sI', self._mm, 0)
+        if magic != MAGIC:
+            raise ValueError(f'{filename} is not a binary index file')
+        if version != VERSION:
+            raise ValueError(f'{filename} has index version {version}, expected {VERSION}')
+        (magic, version, self.weight_bits, self.num_terms, self.num_docs, self._blocks_offset, self._dictionary_offset,
+         self._postings_offset, self._docs_offset, self._doc_strings_offset) = HEADER.unpack_from(self._mm, 0)
+        self.num_blocks = (self.num_terms + BLOCK_SIZE - 1) // BLOCK_SIZE
+
+        self._last_lookup = (None, None)
+        self.doc_mapping = BinaryDocMapping(self)
+
+    def close(self):
+        self._mm.close()
+        self._file.close()
+
+    def _read_vbyte(self, offset):
+        n = 0
+        shift = 0
+        while True:
+            b = self._mm[offset]
+            offset += 1
+            if b & 128:
+                return n | ((b & 127) << shift), offset
+            n |= b << shift
+            shift += 7
+
+    def _block_terms(self, block):
+        """
+        Decodes the dictionary entries of a block, yields (term bytes, (doc_freq, total_freq, postings start, postings size, max score, scale))
+        """
+        dictionary_offset, postings_offset = BLOCK_ENTRY.unpack_from(self._mm, self._blocks_offset + block * BLOCK_ENTRY.size)
+        offset = self._dictionary_offset + dictionary_offset
+        postings_start = self._postings_offset + postings_offset
+        term = b''
+        for i in range(min(BLOCK_SIZE, self.num_terms - block * BLOCK_SIZE)):
+            prefix, offset = self._read_vbyte(offset)
+            suffix_length, offset = self._read_vbyte(offset)
+            term = term[:prefix] + self._mm[offset:offset + suffix_length]
+            offset += suffix_length
+            doc_freq, offset = self._read_vbyte(offset)
+            total_freq, offset = self._read_vbyte(offset)
+            postings_size, offset = self._read_vbyte(offset)
+            scale = 0
+            if self.weight_bits:
+                max_score, scale = struct.unpack_from('<ff', self._mm, offset)
+                offset += 2 * SCORE32.size
+            else:
+                max_score = SCORE.unpack_from(self._mm, offset)[0]
+                offset += SCORE.size
+            yield term, (doc_freq, total_freq, postings_start, postings_size, max_score, scale)
+            postings_start += postings_size
+
+    def _block_first_term(self, block):
+        dictionary_offset = BLOCK_ENTRY.unpack_from(self._mm, self._blocks_offset + block * BLOCK_ENTRY.size)[0]
+        offset = self._dictionary_offset + dictionary_offset
+        prefix, offset = self._read_vbyte(offset)
+        length, offset = self._read_vbyte(offset)
+        return self._mm[offset:offset + length]
+
+    def _find_term(self, term):
+        """
+        Returns the dictionary entry of a term or None if the term is not in the index
+        """
+        if self._last_lookup[0] == term:
+            return self._last_lookup[1]
+
+        # binary search for the last block whose first term is <= the term, then scan that block
+        encoded = term.encode('utf-8')
+        lo, hi = 0, self.num_blocks
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._block_first_term(mid) <= encoded:
+                lo = mid + 1
+            else:
+                hi = mid
+
+        entry = None
+        if lo > 0:
+            for block_term, block_entry in self._block_terms(lo - 1):
+                if block_term == encoded:
+                    entry = block_entry
+                    break
+                if block_term > encoded:
+                    break
+
+        self._last_lookup = (term, entry)
+        return entry
+
+    def _postings_arrays(self, entry):
+        """
+        Decodes the doc ids and weights of a postings list
+        """
+        doc_freq, total_freq, start, size, max_score, scale = entry
+        data = self._mm[start:start + size]
+        if self.weight_bits:
+            weights_size = packed_size(doc_freq, self.weight_bits)
+            weights = dequantize_weights(unpack_bits(data, doc_freq, self.weight_bits), scale, self.weight_bits)
+            return decode_doc_ids(data[weights_size:], doc_freq), weights
+
+        doc_ids = array('I')
+        doc_ids.frombytes(data[:4 * doc_freq])
+        weights = array('d')
+        weights.frombytes(data[4 * doc_freq:])
+        return doc_ids, weights
+
+    def postings(self, term):
+        """
+        Returns the (doc_ids, weights) of a term's postings list or None if the term is not in the index
+        """
+        entry = self._find_term(term)
+        if entry is None:
+            return None
+        return self._postings_arrays(entry)
+
+    def max_score(self, term):
+        """
+        Returns the largest weight / doc_vector_length in the postings list of a term
+        """
+        entry = self._find_term(term)
+        if entry is None:
+            raise KeyError(term)
+        return entry[4]
+
+    def weight_scale(self, term):
+        """
+        Returns the scale the weights of a term were quantized with (0 for an uncompressed index), see postings_codec.quantize_weights
+        """
+        entry = self._find_term(term)
+        if entry is None:
+            raise KeyError(term)
+        return entry[5]
+
+    def __len__(self):
+        return self.num_terms
+
+    def __contains__(self, term):
+        return self._find_term(term) is not None
+
+    def __getitem__(self, term):
+        entry = self._find_term(term)
+        if entry is None:
+            raise KeyError(term)
+        doc_ids, weights = self._postings_arrays(entry)
+        return [entry[0], entry[1], [[doc_id, weight] for doc_id, weight in zip(doc_ids, weights)]]
+
+    def keys(self):
+        for block in range(self.num_blocks):
+            for term, entry in self._block_terms(block):
+                yield term.decode('utf-8')
+
+    def doc_freqs(self):
+        """
+        Yields (term, doc_freq) for every term from the dictionary alone, without touching the postings
+        """
+        for block in range(self.num_blocks):
+            for term, entry in self._block_terms(block):
+                yield term.decode('utf-8'), entry[0]
+
+    def iter_postings(self):
+        """
+        Yields (term, doc_ids, weights) for every term in dictionary order, reading the dictionary sequentially instead of looking up each term
+        """
+        for block in range(self.num_blocks):
+            for term, entry in self._block_terms(block):
+                doc_ids, weights = self._postings_arrays(entry)
+                yield term.decode('utf-8'), doc_ids, weights
+
+    def __iter__(self):
+        return self.keys()
+
+
+class BinaryDocMapping:
+    """
+    Read-only view of the doc table of a binary index.
+    Behaves like the {doc_id: [doc_name, doc_vector_length]} dict loaded from json (doc ids as string keys)
+    """
+
+    def __init__(self, index):
+        self._index = index
+        self._mm = index._mm
+        self._offset = index._docs_offset
+        self._count = index.num_docs
+
+        # documents built by InvertedIndex are numbered 1..n so the doc table can usually be indexed directly
+        self._first_id = self._doc_id_at(0) if self._count else 0
+        self._dense = self._count == 0 or self._doc_id_at(self._count - 1) - self._first_id == self._count - 1
+
+    def _doc_id_at(self, i):
+        return struct.unpack_from('<I', self._mm, self._offset + i * DOC_ENTRY.size)[0]
+
+    def _find_doc(self, doc_id):
+        if self._dense:
+            i = doc_id - self._first_id
+            return i if 0 <= i < self._count else -1
+
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._doc_id_at(mid) < doc_id:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self._count and self._doc_id_at(lo) == doc_id:
+            return lo
+        return -1
+
+    def _entry(self, i):
+        doc_id, string_offset, string_length, doc_length = DOC_ENTRY.unpack_from(self._mm, self._offset + i * DOC_ENTRY.size)
+        start = self._index._doc_strings_offset + string_offset
+        return doc_id, [self._mm[start:start + string_length].decode('utf-8'), doc_length]
+
+    def __len__(self):
+        return self._count
+
+    def __contains__(self, doc_id):
+        return self._find_doc(int(doc_id)) >= 0
+
+    def __getitem__(self, doc_id):
+        i = self._find_doc(int(doc_id))
+        if i < 0:
+            raise KeyError(doc_id)
+        return self._entry(i)[1]
+
+    def keys(self):
+        for i in range(self._count):
+            yield str(self._doc_id_at(i))
+
+    def items(self):
+        for i in range(self._count):
+            doc_id, values = self._entry(i)
+            yield str(doc_id), values
+
+    def __iter__(self):
+        return self.keys()
@@ -0,0 +1,182 @@
+import re
+import sys
+import time
+import json
+import threading
+from collections import Counter
+
+
+class Metrics:
+    """
+    Collects stage timers and counters for InvertedIndex and QueryEngine and exports them as json or prometheus text.
+    Pass an instance to InvertedIndex / QueryEngine to turn instrumentation on, they use NULL_METRICS otherwise
+    """
+
+    enabled = True
+
+    def __init__(self, prefix='ir'):
+        self.prefix = prefix
+        self.timers = {}        # {name: [count, total_seconds, max_seconds]}
+        self.counters = {}      # {name: value}
+        self.profiles = {}      # {name: Counter of sampled stacks}
+        self.hooks = []         # callables called with (timer name, seconds) after every timed stage
+        self.lock = threading.Lock()
+
+    def timer(self, name):
+        """
+        Context manager that times a stage:  with metrics.timer('preprocess_query'): ...
+        """
+        return _Timer(self, name)
+
+    def record(self, name, seconds):
+        with self.lock:
+            values = self.timers.get(name)
+            if values is None:
+                self.timers[name] = [1, seconds, seconds]
+            else:
+                values[0] += 1
+                values[1] += seconds
+                values[2] = max(values[2], seconds)
+        for hook in self.hooks:
+            hook(name, seconds)
+
+    def incr(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def add_hook(self, hook):
+        """
+        Registers a callable(name, seconds) that is called after every timed stage, e.g. to log slow queries
+        """
+        self.hooks.append(hook)
+
+    def profile(self, name, interval=0.001):
+        """
+        Context manager that runs a sampling profiler over the block and adds the sampled stacks to profiles[name]
+        """
+        return SamplingProfiler(self, name, interval)
+
+    def reset(self):
+        with self.lock:
+            self.timers = {}
+            self.counters = {}
+            self.profiles = {}
+
+    def to_dict(self):
+        with self.lock:
+            return {
+                'timers': {name: {'count': count, 'total_seconds': total, 'max_seconds': maximum}
+                           for name, (count, total, maximum) in self.timers.items()},
+                'counters': dict(self.counters),
+                'profiles': {name: dict(stacks.most_common(20)) for name, stacks in self.profiles.items()},
+            }
+
+    def to_json(self):
+        return json.dumps(self.to_dict())
+
+    def to_prometheus(self):
+        """
+        Returns the timers as prometheus summaries and the counters as prometheus counters in the text exposition format
+        """
+        lines = []
+        with self.lock:
+            for name, (count, total, maximum) in sorted(self.timers.items()):
+                metric = self.metric_name(name) + '_seconds'
+                lines.append(f'# TYPE {metric} summary')
+                lines.append(f'{metric}_count {count}')
+                lines.append(f'{metric}_sum {total}')
+                lines.append(f'# TYPE {metric}_max gauge')
+                lines.append(f'{metric}_max {maximum}')
+            for name, value in sorted(self.counters.items()):
+                metric = self.metric_name(name) + '_total'
+                lines.append(f'# TYPE {metric} counter')
+                lines.append(f'{metric} {value}')
+        return '\n'.join(lines) + '\n'
+
+    def metric_name(self, name):
+        return re.sub(r'[^a-zA-Z0-9_]', '_', f'{self.prefix}_{name}')
+
+
+class _Timer:
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.metrics.record(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class SamplingProfiler:
+    """
+    Samples the stack of the profiled thread from a background thread every interval seconds.
+    Stacks are stored collapsed ('outer;inner;innermost' -> samples) which flamegraph tools can read
+    """
+
+    def __init__(self, metrics, name, interval=0.001):
+        self.metrics = metrics
+        self.name = name
+        self.interval = interval
+        self.samples = Counter()
+        self.stopped = threading.Event()
+
+    def __enter__(self):
+        self.thread_id = threading.get_ident()
+        self.sampler = threading.Thread(target=self.run, daemon=True)
+        self.sampler.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stopped.set()
+        self.sampler.join()
+        with self.metrics.lock:
+            self.metrics.profiles.setdefault(self.name, Counter()).update(self.samples)
+        return False
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(f'{frame.f_code.co_name} ({frame.f_code.co_filename.split("/")[-1]}:{frame.f_lineno})')
+                frame = frame.f_back
+            if stack:
+                self.samples[';'.join(reversed(stack))] += 1
+
+
+class NullMetrics:
+    """
+    Stand-in used when instrumentation is off, every call is a no-op so the hot paths pay almost nothing
+    """
+
+    enabled = False
+
+    def timer(self, name):
+        return _NULL_TIMER
+
+    def record(self, name, seconds):
+        pass
+
+    def incr(self, name, value=1):
+        pass
+
+    def profile(self, name, interval=0.001):
+        return _NULL_TIMER
+
+
+class _NullTimer:
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+NULL_METRICS = NullMetrics()
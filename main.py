@@ -54,12 +54,13 @@ CORPUS_ROOT = f'{os.getcwd()}/corpus_songs'
 if SCRAPE_GENIUS:
     # scrape the lyric data from genius.com and each song as seperate documents under the corpus folder
     access_token = 'SUPPLY ACCESS TOKEN HERE'
-    genius = GeniusApi(access_token)
+    genius = GeniusApi(access_token, requests_per_second=5)
 
     # will try to get 30 songs from each artist
     # though most will have less because the API returns all songs the artist has been a part of
     # we only want the songs that the artist is the primary artist on though
-    genius.get_songs_for_all_artists(artists, num_songs=NUM_SONGS, out_folder='corpus_songs')
+    # songs are downloaded by a pool of threads and progress is checkpointed, so an interrupted scrape picks up where it left off
+    genius.crawl_all_artists(artists, num_songs=NUM_SONGS, out_folder='corpus_songs', checkpoint_file='genius_checkpoint.json')
 
 # create an inverted index based on the documents in the corpus folder
 index_creator = InvertedIndex(CORPUS_ROOT)
@@ -77,8 +78,11 @@ index_creator.export_weighted_index('rap_tfxidf_weighted_index.json')
 index_creator.export_inverted_index('rap_raw_count_index.json')
 index_creator.export_document_mapping('rap_document_mapping.json')
 
-# initialize the query engine with the desired inverted index and document mapping
-query_engine = QueryEngine('rap_tfxidf_weighted_index.json', 'rap_document_mapping.json')
+# the binary index holds the weighted index and document mapping in one file that is memory mapped on load
+index_creator.export_binary_index('rap_tfxidf_weighted_index.idx')
+
+# initialize the query engine with the binary index (the json index and document mapping work as well)
+query_engine = QueryEngine('rap_tfxidf_weighted_index.idx')
 
 # make some queries and print out the results
 results = query_engine.query('cars money dollars quarters', num_results=10, print_results='rap_lyrics')
@@ -0,0 +1,185 @@
+import os
+import struct
+from array import array
+from text_analyzer import TextAnalyzer
+from postings_codec import encode_doc_ids, decode_doc_ids
+from postings_ops import intersect
+
+MAGIC = b'IRPI'
+VERSION = 1
+
+# magic, version, number of terms
+HEADER = struct.Struct('<4sII')
+# term length, doc_freq, length of the position data
+TERM_HEADER = struct.Struct('<III')
+
+
+class PositionalIndex:
+    """
+    Positions of every term in every document, for phrase and proximity queries.
+    Every term has parallel arrays of doc ids and term counts plus the gap + variable byte encoded positions of each document
+    back to back in one buffer: {term: [doc_ids, counts, offsets, position_data]}, the positions of the i-th document are
+    position_data[offsets[i]:offsets[i+1]]. Positions count the stems the analyzer keeps (stop words are dropped from
+    documents and queries alike) and are only decoded for the documents that are left after intersecting the doc ids
+    """
+
+    def __init__(self, analyzer=None):
+        self.analyzer = analyzer if analyzer is not None else TextAnalyzer()
+        self.postings = {}
+        self.positions_decoded = 0  # number of position lists decoded, to see how much the doc id intersection saves
+
+    def add_document(self, doc_id, lines):
+        """
+        Adds the positions of a document given an iterable of lines (e.g. an open file).
+        Documents have to be added in increasing doc id order
+        """
+        term_positions = {}
+        position = 0
+        for line in lines:
+            for stem in self.analyzer.analyze(line):
+                term_positions.setdefault(stem, []).append(position)
+                position += 1
+
+        for term, positions in term_positions.items():
+            entry = self.postings.get(term)
+            if entry is None:
+                entry = self.postings[term] = [array('I'), array('I'), array('I', [0]), bytearray()]
+            entry[0].append(doc_id)
+            entry[1].append(len(positions))
+            entry[3] += encode_doc_ids(positions)
+            entry[2].append(len(entry[3]))
+
+    def doc_ids(self, term):
+        entry = self.postings.get(term)
+        return entry[0] if entry is not None else array('I')
+
+    def positions(self, term, i):
+        """
+        Decodes the positions of the i-th document in the postings of a term
+        """
+        doc_ids, counts, offsets, data = self.postings[term]
+        self.positions_decoded += 1
+        return decode_doc_ids(data[offsets[i]:offsets[i + 1]], counts[i])
+
+    def candidates(self, terms):
+        """
+        Returns (distinct terms, [(doc_id, [index of the doc in the postings of each distinct term]), ...]) for the documents
+        that contain every term
+        """
+        distinct_terms = list(dict.fromkeys(terms))
+        if any(term not in self.postings for term in distinct_terms):
+            return distinct_terms, []
+        return distinct_terms, intersect([self.postings[term][0] for term in distinct_terms])
+
+    def phrase_matches(self, terms):
+        """
+        Returns {doc_id: number of occurrences} of the documents that contain the terms as a phrase (consecutive positions)
+        """
+        if not terms:
+            return {}
+        distinct_terms, candidates = self.candidates(terms)
+        if not candidates:
+            return {}
+
+        # the phrase is anchored on the query position of the rarest term, the other terms are only decoded while starts are left
+        anchor = min(range(len(terms)), key=lambda k: len(self.postings[terms[k]][0]))
+
+        matches = {}
+        for doc_id, indexes in candidates:
+            term_indexes = dict(zip(distinct_terms, indexes))
+            starts = [position - anchor for position in self.positions(terms[anchor], term_indexes[terms[anchor]]) if position >= anchor]
+            decoded = {}
+            for k, term in enumerate(terms):
+                if not starts:
+                    break
+                if k == anchor:
+                    continue
+                if term not in decoded:
+                    decoded[term] = set(self.positions(term, term_indexes[term]))
+                starts = [start for start in starts if start + k in decoded[term]]
+            if starts:
+                matches[doc_id] = len(starts)
+        return matches
+
+    def proximity_matches(self, terms, window):
+        """
+        Returns {doc_id: smallest span} of the documents where all terms occur, in any order, within window consecutive positions
+        """
+        if not terms:
+            return {}
+        distinct_terms, candidates = self.candidates(terms)
+
+        matches = {}
+        for doc_id, indexes in candidates:
+            merged = sorted((position, k) for k, (term, i) in enumerate(zip(distinct_terms, indexes)) for position in self.positions(term, i))
+            span = smallest_span(merged, len(distinct_terms))
+            if span <= window:
+                matches[doc_id] = span
+        return matches
+
+    def save(self, filename):
+        """
+        Writes the index to a binary file, written to a temporary file first and moved in place
+        """
+        temp_filename = filename + '.tmp'
+        with open(temp_filename, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, VERSION, len(self.postings)))
+            for term in sorted(self.postings):
+                doc_ids, counts, offsets, data = self.postings[term]
+                encoded = term.encode('utf-8')
+                f.write(TERM_HEADER.pack(len(encoded), len(doc_ids), len(data)))
+                f.write(encoded)
+                f.write(doc_ids.tobytes())
+                f.write(counts.tobytes())
+                f.write(offsets.tobytes())
+                f.write(data)
+        os.replace(temp_filename, filename)
+
+    @classmethod
+    def load(cls, filename, analyzer=None):
+        index = cls(analyzer)
+        with open(filename, 'rb') as f:
+            buffer = f.read()
+        magic, version, num_terms = HEADER.unpack_from(buffer, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f'{filename} is not a version {VERSION} positional index')
+
+        offset = HEADER.size
+        for i in range(num_terms):
+            term_length, doc_freq, data_length = TERM_HEADER.unpack_from(buffer, offset)
+            offset += TERM_HEADER.size
+            term = buffer[offset:offset + term_length].decode('utf-8')
+            offset += term_length
+            entry = []
+            for length in (doc_freq, doc_freq, doc_freq + 1):
+                values = array('I')
+                values.frombytes(buffer[offset:offset + 4 * length])
+                offset += 4 * length
+                entry.append(values)
+            entry.append(buffer[offset:offset + data_length])
+            offset += data_length
+            index.postings[term] = entry
+        return index
+
+
+def smallest_span(merged, num_terms):
+    """
+    Given the sorted (position, term number) pairs of a document, returns the length of the smallest window
+    that holds every one of num_terms terms
+    """
+    counts = [0] * num_terms
+    covered = 0
+    best = float('inf')
+    start = 0
+    for position, k in merged:
+        if counts[k] == 0:
+            covered += 1
+        counts[k] += 1
+        while covered == num_terms:
+            first_position, first_k = merged[start]
+            best = min(best, position - first_position + 1)
+            counts[first_k] -= 1
+            if counts[first_k] == 0:
+                covered -= 1
+            start += 1
+    return best
@@ -0,0 +1,141 @@
+from itertools import accumulate
+
+
+def encode_vbyte(numbers):
+    """
+    Variable byte encodes non-negative integers, 7 bits per byte with the high bit set on the last byte of each number
+    """
+    out = bytearray()
+    for n in numbers:
+        while n >= 128:
+            out.append(n & 127)
+            n >>= 7
+        out.append(n | 128)
+    return bytes(out)
+
+
+def decode_vbyte(data, count):
+    """
+    Decodes the first count numbers of variable byte encoded data
+    """
+    numbers = []
+    n = 0
+    shift = 0
+    for b in data:
+        if b & 128:
+            numbers.append(n | ((b & 127) << shift))
+            if len(numbers) == count:
+                break
+            n = 0
+            shift = 0
+        else:
+            n |= b << shift
+            shift += 7
+    return numbers
+
+
+def encode_doc_ids(doc_ids):
+    """
+    Gap encodes a sorted list of doc ids with variable byte codes, small gaps take a single byte
+    """
+    gaps = [doc_id - previous for previous, doc_id in zip([0] + doc_ids[:-1], doc_ids)]
+    return encode_vbyte(gaps)
+
+
+def decode_doc_ids(data, count):
+    return list(accumulate(decode_vbyte(data, count)))
+
+
+def pack_bits(values, bits):
+    """
+    Packs integers of the given bit width back to back into bytes
+    """
+    if bits == 8:
+        return bytes(values)
+    if not values:
+        return b''
+    bitstring = ''.join(format(value, f'0{bits}b') for value in values)
+    num_bytes = packed_size(len(values), bits)
+    return int(bitstring.ljust(num_bytes * 8, '0'), 2).to_bytes(num_bytes, 'big')
+
+
+def unpack_bits(data, count, bits):
+    if bits == 8:
+        return list(data[:count])
+    if not count:
+        return []
+    num_bytes = packed_size(count, bits)
+    bitstring = format(int.from_bytes(data[:num_bytes], 'big'), f'0{num_bytes * 8}b')
+    return [int(bitstring[i:i + bits], 2) for i in range(0, count * bits, bits)]
+
+
+def packed_size(count, bits):
+    return (count * bits + 7) // 8
+
+
+def quantize_weights(weights, bits, scale=None):
+    """
+    Linearly quantizes weights to integers of the given bit width relative to the largest weight (or to scale).
+    Returns (scale, quantized_weights), a weight is recovered as quantized * scale / (2^bits - 1)
+    """
+    if scale is None:
+        scale = max(weights) if weights else 0
+    levels = (1 << bits) - 1
+    if scale <= 0:
+        return 0, [0] * len(weights)
+    return scale, [min(levels, round(weight / scale * levels)) for weight in weights]
+
+
+def dequantize_weights(quantized, scale, bits):
+    step = scale / ((1 << bits) - 1)
+    return [q * step for q in quantized]
+
+
+def quantization_error_bound(scale, bits):
+    """
+    Largest difference between a weight and its quantized value: half a quantization step
+    """
+    return scale / (2 * ((1 << bits) - 1))
+
+
+def measure_ranking_error(exact_engine, quantized_engine, queries, k=10):
+    """
+    Runs the same queries against an engine over the exact index and one over a quantized binary index.
+    Returns the largest score difference and how much the top k rankings agree, together with the error bounds that
+    follow from the quantization: the largest per-term weight error of the query terms (quantization_error_bound of their scales)
+    and the largest score error that allows (the per-term bounds of the query summed and normalized like the score)
+    """
+    index = quantized_engine.binary_index
+    max_score_error = 0
+    max_weight_error_bound = 0
+    max_score_error_bound = 0
+    overlap = 0
+    identical = 0
+    for query in queries:
+        exact = exact_engine.query(query, num_results=k, print_results=False)
+        quantized = quantized_engine.query(query, num_results=k, print_results=False)
+
+        term_bounds = [quantization_error_bound(index.weight_scale(term), index.weight_bits)
+                       for term in quantized_engine.query_processed if term in index]
+        if term_bounds:
+            max_weight_error_bound = max(max_weight_error_bound, max(term_bounds))
+
+        exact_scores = dict(exact)
+        for doc_id, score in quantized:
+            if doc_id in exact_scores:
+                max_score_error = max(max_score_error, abs(score - exact_scores[doc_id]))
+                doc_length = quantized_engine.doc_lengths[int(doc_id)]
+                # the query length is 0 when no query term is left after preprocessing (e.g. only stopwords)
+                if doc_length and quantized_engine.query_length:
+                    max_score_error_bound = max(max_score_error_bound, sum(term_bounds) / (doc_length * quantized_engine.query_length))
+
+        overlap += len(set(exact_scores) & {doc_id for doc_id, score in quantized}) / k
+        identical += [doc_id for doc_id, score in exact] == [doc_id for doc_id, score in quantized]
+
+    return {
+        'max_score_error': max_score_error,
+        'max_score_error_bound': max_score_error_bound,
+        'max_weight_error_bound': max_weight_error_bound,
+        'mean_overlap_at_k': overlap / len(queries) if queries else 1,
+        'identical_rankings': identical / len(queries) if queries else 1,
+    }
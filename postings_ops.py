@@ -0,0 +1,77 @@
+import heapq
+from bisect import bisect_left
+
+
+def gallop(values, target, lo=0):
+    """
+    Returns the first index >= lo whose value is >= target (len(values) if there is none) in a sorted sequence.
+    Steps ahead 1, 2, 4, ... positions before binary searching, so a search close to lo costs O(log distance)
+    instead of O(log n) and a run of searches over one list skips most of its entries
+    """
+    n = len(values)
+    if lo >= n or values[lo] >= target:
+        return lo
+    step = 1
+    hi = lo + 1
+    while hi < n and values[hi] < target:
+        lo = hi
+        step *= 2
+        hi = lo + step
+    return bisect_left(values, target, lo + 1, min(hi, n))
+
+
+def intersect(postings_lists):
+    """
+    Intersects sorted doc id lists, rarest list first.
+    Returns [(doc_id, [index of doc_id in every list]), ...] where the indexes are in the order of the lists that were passed in.
+    Candidates come from the rarest list and are looked up in the longer lists by galloping, when a lookup misses
+    the rarest list gallops ahead to the doc id that was found, so most of the long lists are never looked at
+    """
+    if not postings_lists or any(len(doc_ids) == 0 for doc_ids in postings_lists):
+        return []
+
+    order = sorted(range(len(postings_lists)), key=lambda i: len(postings_lists[i]))
+    rarest = postings_lists[order[0]]
+    cursors = [0] * len(postings_lists)
+    matches = []
+
+    i = 0
+    while i < len(rarest):
+        doc_id = rarest[i]
+        for j in order[1:]:
+            doc_ids = postings_lists[j]
+            cursors[j] = gallop(doc_ids, doc_id, cursors[j])
+            if cursors[j] == len(doc_ids):
+                return matches
+            if doc_ids[cursors[j]] != doc_id:
+                i = gallop(rarest, doc_ids[cursors[j]], i + 1)
+                break
+        else:
+            cursors[order[0]] = i
+            matches.append((doc_id, list(cursors)))
+            i += 1
+    return matches
+
+
+def union(postings_lists):
+    """
+    Merges sorted doc id lists into one sorted list without duplicates
+    """
+    merged = []
+    for doc_id in heapq.merge(*postings_lists):
+        if not merged or merged[-1] != doc_id:
+            merged.append(doc_id)
+    return merged
+
+
+def difference(doc_ids, excluded):
+    """
+    Returns the doc ids of a sorted list that are not in the sorted excluded list, galloping through the excluded list
+    """
+    result = []
+    cursor = 0
+    for doc_id in doc_ids:
+        cursor = gallop(excluded, doc_id, cursor)
+        if cursor == len(excluded) or excluded[cursor] != doc_id:
+            result.append(doc_id)
+    return result
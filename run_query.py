@@ -1,18 +1,58 @@
+import os
 import json
-import string
-import nltk
 import math
+import heapq
+import string
+from bisect import bisect_left
+from index_file import BinaryIndex, is_binary_index, max_normalized_weight
+from text_analyzer import TextAnalyzer
+from query_cache import QueryCache
+from instrumentation import NULL_METRICS
+from weighting import WeightedIndexView, get_scheme
+from positional_index import PositionalIndex
+from postings_ops import gallop, intersect
+from boolean_query import parse_boolean_query, evaluate_boolean, query_terms
+from term_dictionary import TermDictionary, index_doc_freqs
+from compact_index import CompactIndex, doc_length_table
+from impact_index import ImpactIndex
+
+# punctuation removed from wildcard patterns, everything but the wildcards
+WILDCARD_PUNCTUATION_TABLE = str.maketrans('', '', string.punctuation.replace('*', '').replace('?', ''))
+
+# relative slack added to the score upper bounds so rounding can never prune a document that belongs in the top k
+UPPER_BOUND_SLACK = 1e-9
 
 class QueryEngine:
 
-    def __init__(self, inverted_index_json, doc_mapping_json):
-        with open(inverted_index_json) as f:
-            self.inverted_index = json.load(f)
-        with open(doc_mapping_json) as f:
-            self.doc_mapping = json.load(f)
+    def __init__(self, inverted_index_file, doc_mapping_file=None, analyzer=None, cache_size=1024, cache_ttl=None, metrics=None, weighting=None,
+                 positional_index_file=None, compact=False, impact_index_file=None, normalize_query=True):
+        # timers and counters, see instrumentation.Metrics. profile_queries also samples the stack while queries run
+        self.metrics = metrics if metrics is not None else NULL_METRICS
+        self.profile_queries = False
+
+        self.inverted_index_file = inverted_index_file
+        self.doc_mapping_file = doc_mapping_file
+        # with a weighting scheme (see weighting.SCHEMES) the index files hold raw counts and are weighted at query time
+        self.weighting = get_scheme(weighting) if weighting is not None else None
+        # divide the scores by the query vector length, off for schemes that do not normalize the query (bm25).
+        # Set normalize_query=False for an index that was exported with such a scheme
+        self.normalize_query = self.weighting.normalize_query if self.weighting is not None else normalize_query
+        # json indexes are loaded into a CompactIndex (arrays instead of a list per posting) which takes several times less memory
+        self.compact = compact
+        # term positions for phrase and proximity queries, optional since they take more space than the index itself
+        self.positional_index_file = positional_index_file
+        # impact ordered postings for score-at-a-time queries with a budget, built from the same weighted index
+        self.impact_index_file = impact_index_file
+
+        # queries have to be processed exactly like the documents were when the index was built
+        self.analyzer = analyzer if analyzer is not None else TextAnalyzer()
+
+        self.binary_index = None
+        self.index_version = None
+        self.load_index()
 
-        self.stemmer = nltk.PorterStemmer()
-        self.stop_words = nltk.corpus.stopwords.words('english')
+        # results of recent queries, cleared whenever the index files change
+        self.cache = QueryCache(max_size=cache_size, ttl=cache_ttl)
 
         self.query_raw = None
         self.query_processed = None
@@ -20,44 +60,346 @@ class QueryEngine:
 
         self.top_results = None
 
-    def query(self, query, num_results=5, print_results='general'):
+    def load_index(self):
+        """
+        Loads (or reloads) the index and document mapping files, and the positional and impact indexes if there are any
+        """
+        if self.binary_index is not None:
+            self.binary_index.close()
+            self.binary_index = None
+
+        self.index_version = self.current_index_version()
+        # a binary index file holds the document mapping too and is memory mapped instead of parsed
+        if is_binary_index(self.inverted_index_file):
+            self.binary_index = BinaryIndex(self.inverted_index_file)
+            self.inverted_index = self.binary_index
+            self.doc_mapping = self.binary_index.doc_mapping
+        elif self.compact:
+            self.inverted_index = CompactIndex.load(self.inverted_index_file, self.doc_mapping_file)
+            self.doc_mapping = self.inverted_index.doc_mapping
+        else:
+            with open(self.inverted_index_file) as f:
+                self.inverted_index = json.load(f)
+            with open(self.doc_mapping_file) as f:
+                self.doc_mapping = json.load(f)
+
+        if self.weighting is not None:
+            self.inverted_index = WeightedIndexView(self.inverted_index, self.doc_mapping, self.weighting)
+            self.doc_mapping = self.inverted_index.doc_mapping
+
+        # doc vector lengths indexed by int doc id, read by the scoring loops instead of self.doc_mapping[str(doc_id)][1]
+        self.doc_lengths = doc_length_table(self.doc_mapping)
+        self.term_upper_bounds = {}     # {term: max weight / doc_length} for json indexes, computed on first use
+        self.term_dictionary = None     # prefix, wildcard and fuzzy term lookups, built on first use
+
+        self.positional_index = PositionalIndex.load(self.positional_index_file, self.analyzer) if self.positional_index_file else None
+        self.impact_index = ImpactIndex.load(self.impact_index_file) if self.impact_index_file else None
+
+    def current_index_version(self):
+        """
+        Identifies the version of the index files on disk by their inode, size and modification time
+        """
+        version = []
+        for filename in (self.inverted_index_file, self.doc_mapping_file, self.positional_index_file, self.impact_index_file):
+            if filename is not None:
+                stat = os.stat(filename)
+                version.append((stat.st_ino, stat.st_size, stat.st_mtime_ns))
+        return tuple(version)
+
+    def check_index_version(self):
+        """
+        Reloads the index and empties the result cache if the index files were rebuilt since they were loaded
+        """
+        if self.current_index_version() != self.index_version:
+            self.load_index()
+            self.cache.clear()
+
+    def query(self, query, num_results=5, print_results='general', exhaustive=False):
         """
         Returns the top n documents that the query is most similar to
+        By default the top n are found with MaxScore pruning, exhaustive=True scores every document instead
+        Both return the same ranking
+        """
+        profiler = self.metrics if self.profile_queries else NULL_METRICS
+        with self.metrics.timer('query'), profiler.profile('query'):
+            self.metrics.incr('queries')
+            if exhaustive:
+                self.top_results = self.exhaustive_query(query, num_results)
+            else:
+                self.top_results = self.cached_query(query, num_results)
+
+        if print_results:
+            self.print_results(method=print_results)
+        return self.top_results
+
+    def cached_query(self, query, num_results):
+        """
+        Top n with MaxScore, going through the result cache
+        """
+        self.check_index_version()
+        self.query_raw = query
+        with self.metrics.timer('preprocess_query'):
+            self.query_processed = self.preprocess_query(self.query_raw)
+
+        # the order of the terms does not change the ranking so it is dropped from the cache key
+        cache_key = (tuple(sorted(self.query_processed)), num_results)
+        cached_results = self.cache.get(cache_key)
+        if cached_results is None:
+            self.metrics.incr('cache_misses')
+            with self.metrics.timer('score'):
+                cached_results = self.top_k(self.query_processed, num_results)
+            self.cache.put(cache_key, cached_results)
+        else:
+            self.metrics.incr('cache_hits')
+        return list(cached_results)
+
+    def exhaustive_query(self, query, num_results):
+        """
+        Scores every document and sorts them all
         """
+        self.check_index_version()
         similarity_scores = {doc_id:0 for doc_id in self.doc_mapping.keys()}
         self.query_raw = query
-        self.query_processed = self.preprocess_query(self.query_raw)
+        with self.metrics.timer('preprocess_query'):
+            self.query_processed = self.preprocess_query(self.query_raw)
         
         # calculate the similarity score for all terms and add them up
-        for term in self.query_processed:
-            sim_scores = self.calculate_similarity(term)
-            for doc_id, score in sim_scores.items():
-                similarity_scores[str(doc_id)] += score
+        with self.metrics.timer('score'):
+            for term in self.query_processed:
+                sim_scores = self.calculate_similarity(term)
+                for doc_id, score in sim_scores.items():
+                    similarity_scores[str(doc_id)] += score
+        self.metrics.incr('docs_scored', len(similarity_scores))
+
+        with self.metrics.timer('sort'):
+            return sorted(similarity_scores.items(), key=lambda x: x[1], reverse=True)[:num_results]
+
+    def phrase_query(self, query, num_results=5, print_results='general', window=None):
+        """
+        Returns the top n documents that contain the query as a phrase, or with window set, that contain all the query terms
+        within window consecutive positions. Matching documents are ranked by their cosine similarity
+        """
+        if self.positional_index is None:
+            raise ValueError('phrase queries need a positional index, pass positional_index_file')
+
+        with self.metrics.timer('phrase_query'):
+            self.check_index_version()
+            self.query_raw = query
+            with self.metrics.timer('preprocess_query'):
+                self.query_processed = self.preprocess_query(self.query_raw)
+            with self.metrics.timer('match_positions'):
+                if window is None:
+                    matches = self.positional_index.phrase_matches(self.query_processed)
+                else:
+                    matches = self.positional_index.proximity_matches(self.query_processed, window)
+            with self.metrics.timer('score'):
+                scores = self.score_documents(self.query_processed, sorted(matches))
+            self.top_results = sorted(scores.items(), key=lambda x: (-x[1], int(x[0])))[:num_results]
+
+        if print_results:
+            self.print_results(method=print_results)
+        return self.top_results
+
+    def impact_query(self, query, num_results=5, print_results='general', budget=None, time_budget=None):
+        """
+        Returns the top n documents by cosine similarity computed score-at-a-time over the impact index, see ImpactIndex.top_k.
+        Without a budget the ranking matches query() up to the quantization of the impacts. budget (a number of postings)
+        and time_budget (seconds) stop the evaluation early: the highest impact postings are processed first, so a tight
+        budget loses little accuracy while bounding the latency of every query
+        """
+        if self.impact_index is None:
+            raise ValueError('impact queries need an impact index, pass impact_index_file')
+
+        with self.metrics.timer('impact_query'):
+            self.check_index_version()
+            self.query_raw = query
+            with self.metrics.timer('preprocess_query'):
+                self.query_processed = self.preprocess_query(self.query_raw)
+
+            term_counts = {}
+            for term in self.query_processed:
+                term_counts[term] = term_counts.get(term, 0) + 1
+            with self.metrics.timer('score'):
+                ranked, processed, complete = self.impact_index.top_k(term_counts, num_results, budget, time_budget)
+            self.metrics.incr('postings_scanned', processed)
+            if not complete:
+                self.metrics.incr('impact_queries_stopped_early')
+            self.top_results = [(str(doc_id), self.impact_index.impact(level) / self.query_length) for doc_id, level in ranked]
 
-        self.top_results = sorted(similarity_scores.items(), key=lambda x: x[1], reverse=True)[:num_results]
-        
         if print_results:
             self.print_results(method=print_results)
-            
         return self.top_results
+
+    def score_documents(self, query_terms, doc_ids):
+        """
+        Returns {doc_id: cosine score} of the given sorted doc ids only, each term's postings are searched by galloping
+        so the cost depends on the number of documents rather than on the length of the postings
+        """
+        contributions = {doc_id: {} for doc_id in doc_ids}
+        for term in set(query_terms):
+            postings = self.term_postings(term)
+            if postings is None:
+                continue
+            postings_doc_ids, weights = postings
+            cursor = 0
+            for doc_id in doc_ids:
+                cursor = gallop(postings_doc_ids, doc_id, cursor)
+                if cursor == len(postings_doc_ids):
+                    break
+                if postings_doc_ids[cursor] == doc_id:
+                    doc_length = self.doc_lengths[doc_id]
+                    contributions[doc_id][term] = weights[cursor] / (doc_length * self.query_length)
+        self.metrics.incr('docs_scored', len(doc_ids))
+        return {str(doc_id): self.query_order_score(query_terms, doc_contributions) for doc_id, doc_contributions in contributions.items()}
+
+    def query_order_score(self, query_terms, contributions):
+        """
+        Adds up the {term: score} contributions of a document in query order, so the total is exactly the one the exhaustive path computes
+        """
+        score = 0
+        for term in query_terms:
+            if term in contributions:
+                score += contributions[term]
+        return score
+
+    def conjunctive_query(self, query, num_results=5, print_results='general'):
+        """
+        Returns the top n documents that contain every query term, ranked by cosine similarity.
+        The postings are intersected from the rarest term up with galloping search, so only the documents of the rarest
+        term are candidates and the postings of common terms are mostly skipped
+        """
+        with self.metrics.timer('conjunctive_query'):
+            self.check_index_version()
+            self.query_raw = query
+            with self.metrics.timer('preprocess_query'):
+                self.query_processed = self.preprocess_query(self.query_raw)
+
+            distinct_terms = list(dict.fromkeys(self.query_processed))
+            postings = [self.term_postings(term) for term in distinct_terms]
+            scores = {}
+            if distinct_terms and all(term_postings is not None for term_postings in postings):
+                with self.metrics.timer('intersect'):
+                    matches = intersect([doc_ids for doc_ids, weights in postings])
+                with self.metrics.timer('score'):
+                    for doc_id, indexes in matches:
+                        doc_length = self.doc_lengths[doc_id]
+                        contributions = {term: postings[j][1][indexes[j]] / (doc_length * self.query_length)
+                                         for j, term in enumerate(distinct_terms)}
+                        scores[str(doc_id)] = self.query_order_score(self.query_processed, contributions)
+                self.metrics.incr('docs_scored', len(matches))
+            self.top_results = sorted(scores.items(), key=lambda x: (-x[1], int(x[0])))[:num_results]
+
+        if print_results:
+            self.print_results(method=print_results)
+        return self.top_results
+
+    def boolean_query(self, query, num_results=5, print_results='general'):
+        """
+        Returns the top n documents matching a Boolean query such as 'kendrick AND (lamar OR kunta) NOT drake',
+        see boolean_query.parse_boolean_query. Matching documents are ranked by cosine similarity over the words that are not negated
+        """
+        with self.metrics.timer('boolean_query'):
+            self.check_index_version()
+            tree = parse_boolean_query(query)
+            self.query_raw = query
+            with self.metrics.timer('preprocess_query'):
+                self.query_processed = self.preprocess_query(' '.join(query_terms(tree)))
+            with self.metrics.timer('intersect'):
+                doc_ids = evaluate_boolean(tree, self.term_doc_ids, self.all_doc_ids)
+            with self.metrics.timer('score'):
+                scores = self.score_documents(self.query_processed, doc_ids or [])
+            self.top_results = sorted(scores.items(), key=lambda x: (-x[1], int(x[0])))[:num_results]
+
+        if print_results:
+            self.print_results(method=print_results)
+        return self.top_results
+
+    def expanded_query(self, query, num_results=5, print_results='general', max_expansions=10, max_distance=2, fuzzy_weight=0.5):
+        """
+        Returns the top n documents for a query whose words can be wildcard patterns (kend*, *rick, k?ndrick),
+        words that are not in the index are replaced by the terms within max_distance edits of them (misspelled names, slang spellings).
+        Every word expands to at most max_expansions terms so the cost of a query stays bounded.
+        Wildcard matches are scored with a term weight of 1, fuzzy matches with fuzzy_weight ** edit distance
+        """
+        with self.metrics.timer('expanded_query'):
+            self.check_index_version()
+            self.query_raw = query
+            with self.metrics.timer('expand_query'):
+                term_weights, squared_weights = self.expand_query(query, max_expansions, max_distance, fuzzy_weight)
+            self.query_processed = list(term_weights)
+            self.query_length = math.sqrt(squared_weights)
+            if not self.normalize_query:
+                self.query_length = 1
+            self.metrics.incr('expanded_terms', len(term_weights))
+            with self.metrics.timer('score'):
+                self.top_results = self.top_k(self.query_processed, num_results, term_weights)
+
+        if print_results:
+            self.print_results(method=print_results)
+        return self.top_results
+
+    def expand_query(self, query, max_expansions=10, max_distance=2, fuzzy_weight=0.5):
+        """
+        Returns ({term: weight}, sum of the squared weights of the query vector) of a query with wildcard and fuzzy expansions
+        """
+        term_dictionary = self.get_term_dictionary()
+        term_weights = {}
+        squared_weights = 0
+        for word in query.split():
+            if '*' in word or '?' in word:
+                pattern = word.translate(WILDCARD_PUNCTUATION_TABLE).lower()
+                expansions = [(term, 1) for term in term_dictionary.wildcard(pattern, max_expansions)]
+            else:
+                expansions = []
+                for term in self.analyzer.analyze(word):
+                    if term in self.inverted_index:
+                        expansions.append((term, 1))
+                    else:
+                        expansions += [(match, fuzzy_weight**distance) for match, distance in term_dictionary.fuzzy(term, max_distance, max_expansions)]
+            for term, weight in expansions:
+                term_weights[term] = term_weights.get(term, 0) + weight
+                squared_weights += weight**2
+        return term_weights, squared_weights
+
+    def get_term_dictionary(self):
+        if self.term_dictionary is None:
+            with self.metrics.timer('term_dictionary'):
+                self.term_dictionary = TermDictionary(index_doc_freqs(self.inverted_index))
+        return self.term_dictionary
+
+    def term_doc_ids(self, word):
+        """
+        Returns the sorted doc ids of the documents that contain a query word, None if the word is a stop word
+        """
+        terms = self.analyzer.analyze(word)
+        if not terms:
+            return None
+        doc_ids = []
+        for term in terms:
+            postings = self.term_postings(term)
+            doc_ids.append(postings[0] if postings is not None else [])
+        return doc_ids[0] if len(doc_ids) == 1 else [doc_id for doc_id, indexes in intersect(doc_ids)]
+
+    def all_doc_ids(self):
+        return sorted(int(doc_id) for doc_id in self.doc_mapping.keys())
+
+    def query_batch(self, queries, k=5):
+        """
+        Returns the top k results for each query in a list
+        """
+        return [self.query(query, num_results=k, print_results=False) for query in queries]
         
     def preprocess_query(self, query):
         """
         Proccesses the query so that it is easier to work with
         """
-        query_processed = []
-        query = query.translate(str.maketrans('', '', string.punctuation))
-        words = [word.strip().lower() for word in query.split()]
-
-        for word in words:
-            # get rid of the word if it has any non-ascii characters or it is a stop word
-            if word not in self.stop_words and all(ord(char) < 128 for char in word):
-                stem = self.stemmer.stem(word) # uses porter stemmer
-                query_processed.append(stem)
+        query_processed = self.analyzer.analyze(query)
 
         # we are treating each query term with a weight of one
         # thus the length of the query vector would be the sqrt(num_terms)
         self.query_length = math.sqrt(len(query_processed))
+        if not self.normalize_query:
+            self.query_length = 1
 
         return query_processed
 
@@ -68,17 +410,148 @@ class QueryEngine:
         sim_scores = {} # {doc_id: similarity_score}
         
         if method == 'cosine':
-            if term in self.inverted_index:
-                postings = self.inverted_index[term][2]
-                for posting in postings:
-                    doc_id = posting[0]
-                    weight = posting[1]
-                    doc_length = self.doc_mapping[str(doc_id)][1]
+            postings = self.term_postings(term)
+            if postings is not None:
+                self.metrics.incr('postings_scanned', len(postings[0]))
+                doc_lengths = self.doc_lengths
+                for doc_id, weight in zip(*postings):
+                    doc_length = doc_lengths[doc_id]
                     score = (weight * term_weight) / (doc_length * self.query_length)
                     sim_scores[doc_id] = score
 
         return sim_scores
 
+    def term_postings(self, term):
+        """
+        Returns the (doc_ids, weights) of a term's postings list or None if the term is not in the index
+        """
+        # binary indexes and weighted views decode or weight the postings themselves
+        if hasattr(self.inverted_index, 'postings'):
+            return self.inverted_index.postings(term)
+        if term not in self.inverted_index:
+            return None
+        postings = self.inverted_index[term][2]
+        return [posting[0] for posting in postings], [posting[1] for posting in postings]
+
+    def term_upper_bound(self, term):
+        """
+        Returns the largest weight / doc_length of a term, the most it can add to a document's score before the query length
+        """
+        if hasattr(self.inverted_index, 'max_score'):
+            return self.inverted_index.max_score(term)
+        if term not in self.term_upper_bounds:
+            self.term_upper_bounds[term] = max_normalized_weight(self.inverted_index[term][2], self.doc_lengths)
+        return self.term_upper_bounds[term]
+
+    def top_k(self, query_terms, k, term_weights=None):
+        """
+        Document-at-a-time MaxScore evaluation of the cosine similarity.
+        Terms are ordered by their score upper bound. The terms whose upper bounds together cannot beat the current
+        k-th best score are non-essential: documents are only taken from the postings of the essential terms
+        and the non-essential postings are only probed (by binary search) for documents that can still make it into the top k.
+        A heap of size k keeps the best documents, ties are broken by doc id like the exhaustive sort.
+        term_weights {term: weight} replaces the number of times each term is in the query, e.g. for expanded terms
+        """
+        if k <= 0:
+            return []
+
+        # multiplicity of each term in the query, repeated terms add their score more than once
+        if term_weights is None:
+            term_counts = {}
+            for term in query_terms:
+                term_counts[term] = term_counts.get(term, 0) + 1
+        else:
+            term_counts = term_weights
+
+        terms = []  # [upper_bound, term, doc_ids, weights]
+        for term, count in term_counts.items():
+            postings = self.term_postings(term)
+            if postings is not None and len(postings[0]):
+                upper_bound = count * self.term_upper_bound(term) / self.query_length * (1 + UPPER_BOUND_SLACK)
+                terms.append([upper_bound, term, postings[0], postings[1]])
+        terms.sort(key=lambda x: x[0])
+
+        # prefix_bounds[i] is the most the first i terms can add up to
+        prefix_bounds = [0]
+        for upper_bound, term, doc_ids, weights in terms:
+            prefix_bounds.append(prefix_bounds[-1] + upper_bound)
+
+        # postings_total is what an exhaustive evaluation would read, postings_scanned and postings_probed what MaxScore actually did
+        self.metrics.incr('postings_total', sum(len(doc_ids) for upper_bound, term, doc_ids, weights in terms))
+        docs_scored = 0
+        postings_scanned = 0    # essential postings consumed by advancing a cursor
+        postings_probed = 0     # binary searches into the non-essential postings
+
+        heap = []           # min-heap of (score, -doc_id), the root is the worst of the current top k
+        threshold = 0       # a document has to score above this to get in
+        first_essential = 0
+        cursors = [0] * len(terms)
+
+        while first_essential < len(terms):
+            # the next candidate is the smallest doc id left in the essential postings lists
+            doc_id = None
+            for i in range(first_essential, len(terms)):
+                doc_ids = terms[i][2]
+                if cursors[i] < len(doc_ids) and (doc_id is None or doc_ids[cursors[i]] < doc_id):
+                    doc_id = doc_ids[cursors[i]]
+            if doc_id is None:
+                break
+
+            docs_scored += 1
+            doc_length = self.doc_lengths[doc_id]
+            contributions = {}
+            partial_score = 0
+            for i in range(first_essential, len(terms)):
+                doc_ids = terms[i][2]
+                if cursors[i] < len(doc_ids) and doc_ids[cursors[i]] == doc_id:
+                    contributions[terms[i][1]] = terms[i][3][cursors[i]] / (doc_length * self.query_length)
+                    partial_score += contributions[terms[i][1]] * term_counts[terms[i][1]]
+                    cursors[i] += 1
+                    postings_scanned += 1
+
+            # probe the non-essential terms from the largest upper bound down while the document can still get in
+            for i in range(first_essential - 1, -1, -1):
+                if len(heap) == k and partial_score + prefix_bounds[i + 1] <= threshold:
+                    break
+                doc_ids = terms[i][2]
+                cursors[i] = bisect_left(doc_ids, doc_id, cursors[i])
+                postings_probed += 1
+                if cursors[i] < len(doc_ids) and doc_ids[cursors[i]] == doc_id:
+                    contributions[terms[i][1]] = terms[i][3][cursors[i]] / (doc_length * self.query_length)
+                    partial_score += contributions[terms[i][1]] * term_counts[terms[i][1]]
+            else:
+                # add the scores up in query order so the total is exactly the one the exhaustive path computes
+                score = 0
+                for term in query_terms:
+                    if term in contributions:
+                        score += contributions[term] if term_weights is None else contributions[term] * term_weights[term]
+
+                if score > 0 and (len(heap) < k or score > threshold):
+                    if len(heap) == k:
+                        heapq.heapreplace(heap, (score, -doc_id))
+                    else:
+                        heapq.heappush(heap, (score, -doc_id))
+                    if len(heap) == k:
+                        threshold = heap[0][0]
+                        while first_essential < len(terms) and prefix_bounds[first_essential + 1] <= threshold:
+                            first_essential += 1
+
+        self.metrics.incr('docs_scored', docs_scored)
+        self.metrics.incr('postings_scanned', postings_scanned)
+        self.metrics.incr('postings_probed', postings_probed)
+
+        results = [(str(-neg_doc_id), score) for score, neg_doc_id in sorted(heap, key=lambda x: (-x[0], -x[1]))]
+
+        # like the exhaustive path, fill up the results with documents that have a score of zero
+        if len(results) < k:
+            scored = {doc_id for doc_id, score in results}
+            for doc_id in self.doc_mapping.keys():
+                if len(results) == k:
+                    break
+                if doc_id not in scored:
+                    results.append((doc_id, 0))
+        return results
+
     def print_results(self, method='general'):
         if method == 'general':
             format_template = "{:10}|{:^25}| {:5}"
@@ -105,3 +578,10 @@ class QueryEngine:
                 if score != 0:
                     print(format_template.format(song, artist, score))
         return
+
+    def close(self):
+        """
+        Releases the memory map of a binary index
+        """
+        if self.binary_index is not None:
+            self.binary_index.close()
@@ -0,0 +1,272 @@
+import os
+import json
+import asyncio
+import argparse
+import multiprocessing
+from urllib.parse import urlsplit, parse_qs
+from concurrent.futures import ProcessPoolExecutor
+from run_query import QueryEngine
+from index_file import is_binary_index
+
+MAX_BODY_SIZE = 10 * 1024 * 1024
+
+# the QueryEngine of a worker process, loaded once by the pool initializer
+_engine = None
+
+
+def _load_engine(inverted_index_file, doc_mapping_file):
+    global _engine
+    # every worker holds its own copy of a json index, so it is kept in the compact layout
+    _engine = QueryEngine(inverted_index_file, doc_mapping_file, compact=True)
+
+
+def _warm_up():
+    return os.getpid()
+
+
+def _search(queries, num_results, method):
+    """
+    Runs queries in a worker process and returns their results as json ready dicts
+    """
+    return [format_results(_engine, _engine.query(query, num_results=num_results, print_results=False), method)
+            for query in queries]
+
+
+def format_results(engine, results, method='general'):
+    """
+    Same information as QueryEngine.print_results: documents with a score of zero are left out
+    and for rap lyrics the document name is split into artist and song
+    """
+    formatted = []
+    for doc_id, score in results:
+        if score == 0:
+            continue
+        doc_name = engine.doc_mapping[str(doc_id)][0]
+        result = {'doc_id': doc_id, 'doc_name': doc_name, 'score': score}
+        if method == 'rap_lyrics':
+            artist, song = doc_name.split('_', 1)
+            result['artist'] = artist
+            result['song'] = song
+        formatted.append(result)
+    return formatted
+
+
+class HttpError(Exception):
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+class SearchService:
+    """
+    Long running asyncio HTTP search service.
+    The index is loaded once per worker process and scoring runs in the process pool, so the event loop only parses requests.
+    Endpoints:
+        GET  /search?q=...&k=10&format=rap_lyrics
+        POST /search/batch   {"queries": [...], "k": 10, "format": "rap_lyrics"}
+        POST /admin/reload   {"index": "new.idx", "doc_mapping": null}
+        GET  /health
+    """
+
+    def __init__(self, inverted_index_file, doc_mapping_file=None, workers=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.inverted_index_file = inverted_index_file
+        self.doc_mapping_file = doc_mapping_file
+        self.pool = None
+        self.generation = 0
+        self.reload_lock = None
+
+    async def start(self, host='127.0.0.1', port=8080):
+        self.reload_lock = asyncio.Lock()
+        self.pool = await self.create_pool(self.inverted_index_file, self.doc_mapping_file)
+        self.server = await asyncio.start_server(self.handle_connection, host, port)
+        return self.server
+
+    async def create_pool(self, inverted_index_file, doc_mapping_file):
+        """
+        Starts a process pool with the index loaded in every worker and waits until they are all up
+        """
+        # spawn rather than fork: forking next to the threads of a running pool can deadlock the new workers
+        pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'),
+                                   initializer=_load_engine, initargs=(inverted_index_file, doc_mapping_file))
+        loop = asyncio.get_running_loop()
+        try:
+            await asyncio.gather(*[loop.run_in_executor(pool, _warm_up) for i in range(self.workers)])
+        except Exception:
+            pool.shutdown(wait=False)
+            raise
+        return pool
+
+    async def reload(self, inverted_index_file, doc_mapping_file=None):
+        """
+        Hot swaps the index: a new pool is loaded with the new index while the old one keeps serving,
+        then new requests go to the new pool and the old pool is shut down once its queued requests are done
+        """
+        async with self.reload_lock:
+            new_pool = await self.create_pool(inverted_index_file, doc_mapping_file)
+            old_pool = self.pool
+            self.pool = new_pool
+            self.inverted_index_file = inverted_index_file
+            self.doc_mapping_file = doc_mapping_file
+            self.generation += 1
+        await asyncio.get_running_loop().run_in_executor(None, old_pool.shutdown)
+
+    async def search(self, queries, num_results, method):
+        """
+        Splits the queries over the workers and gathers the results in order
+        """
+        loop = asyncio.get_running_loop()
+        pool = self.pool
+        chunk_size = max(1, -(-len(queries) // self.workers))
+        chunks = [queries[i:i + chunk_size] for i in range(0, len(queries), chunk_size)]
+        results = await asyncio.gather(*[loop.run_in_executor(pool, _search, chunk, num_results, method) for chunk in chunks])
+        return [result for chunk_results in results for result in chunk_results]
+
+    async def route(self, method, target, body):
+        url = urlsplit(target)
+        params = parse_qs(url.query)
+
+        if url.path == '/health' and method == 'GET':
+            return {'status': 'ok', 'index': self.inverted_index_file, 'generation': self.generation, 'workers': self.workers}
+
+        if url.path == '/search' and method == 'GET':
+            if 'q' not in params:
+                raise HttpError(400, 'missing query parameter q')
+            num_results = self.parse_int(params.get('k', ['10'])[0])
+            result_format = params.get('format', ['general'])[0]
+            results = await self.search([params['q'][0]], num_results, result_format)
+            return {'query': params['q'][0], 'results': results[0]}
+
+        if url.path == '/search/batch' and method == 'POST':
+            request = self.parse_json(body)
+            queries = request.get('queries')
+            if not isinstance(queries, list) or not all(isinstance(query, str) for query in queries):
+                raise HttpError(400, 'queries must be a list of strings')
+            num_results = self.parse_int(request.get('k', 10))
+            results = await self.search(queries, num_results, request.get('format', 'general'))
+            return {'results': results}
+
+        if url.path == '/admin/reload' and method == 'POST':
+            request = self.parse_json(body)
+            if 'index' not in request:
+                raise HttpError(400, 'missing index')
+            for filename in (request['index'], request.get('doc_mapping')):
+                if filename is not None and not isinstance(filename, str):
+                    raise HttpError(400, 'index and doc_mapping must be file names')
+                if filename is not None and not os.path.isfile(filename):
+                    raise HttpError(400, f'{filename} is not a file')
+            # a json index needs its document mapping, only a binary index holds one
+            if request.get('doc_mapping') is None and not is_binary_index(request['index']):
+                raise HttpError(400, f'{request["index"]} is not a binary index, a doc_mapping is needed')
+            try:
+                await self.reload(request['index'], request.get('doc_mapping'))
+            except Exception as e:
+                raise HttpError(500, f'reload failed, still serving the previous index: {e}')
+            return {'status': 'reloaded', 'index': self.inverted_index_file, 'generation': self.generation}
+
+        raise HttpError(404, f'no route for {method} {url.path}')
+
+    def parse_json(self, body):
+        try:
+            request = json.loads(body or b'{}')
+        except ValueError:
+            raise HttpError(400, 'body is not valid json')
+        if not isinstance(request, dict):
+            raise HttpError(400, 'body must be a json object')
+        return request
+
+    def parse_int(self, value):
+        # json numbers like 1.7 (and true/false) are rejected rather than truncated
+        if isinstance(value, bool) or not isinstance(value, (int, str)):
+            raise HttpError(400, f'{value} is not an integer')
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            raise HttpError(400, f'{value} is not an integer')
+
+    async def handle_connection(self, reader, writer):
+        """
+        Minimal HTTP/1.1: one request at a time per connection, keep-alive unless the client asks to close
+        """
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                try:
+                    method, target, version = request_line.decode('latin1').split()
+                except ValueError:
+                    await self.send(writer, 400, {'error': 'bad request line'}, keep_alive=False)
+                    break
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+
+                try:
+                    length = int(headers.get('content-length', 0) or 0)
+                except ValueError:
+                    length = -1
+                if length < 0:
+                    await self.send(writer, 400, {'error': 'bad content-length'}, keep_alive=False)
+                    break
+                if length > MAX_BODY_SIZE:
+                    await self.send(writer, 413, {'error': 'body too large'}, keep_alive=False)
+                    break
+                body = await reader.readexactly(length) if length else b''
+                keep_alive = headers.get('connection', '').lower() != 'close' and version == 'HTTP/1.1'
+
+                try:
+                    status, response = 200, await self.route(method, target, body)
+                except HttpError as e:
+                    status, response = e.status, {'error': e.message}
+                except Exception as e:
+                    status, response = 500, {'error': str(e)}
+                await self.send(writer, status, response, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def send(self, writer, status, response, keep_alive=True):
+        reasons = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 413: 'Payload Too Large', 500: 'Internal Server Error'}
+        body = json.dumps(response).encode('utf-8')
+        head = (f'HTTP/1.1 {status} {reasons.get(status, "")}\r\n'
+                f'Content-Type: application/json\r\n'
+                f'Content-Length: {len(body)}\r\n'
+                f'Connection: {"keep-alive" if keep_alive else "close"}\r\n\r\n')
+        writer.write(head.encode('latin1') + body)
+        await writer.drain()
+
+    def close(self):
+        self.server.close()
+        self.pool.shutdown()
+
+
+async def serve(inverted_index_file, doc_mapping_file, host, port, workers):
+    service = SearchService(inverted_index_file, doc_mapping_file, workers)
+    server = await service.start(host, port)
+    print(f'serving {inverted_index_file} on http://{host}:{port} with {service.workers} workers')
+    async with server:
+        await server.serve_forever()
+
+
+# python search_service.py rap_tfxidf_weighted_index.idx --port 8080
+# python search_service.py rap_tfxidf_weighted_index.json --doc-mapping rap_document_mapping.json
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='HTTP search service over a prebuilt index')
+    parser.add_argument('index', help='binary index file, or json weighted index together with --doc-mapping')
+    parser.add_argument('--doc-mapping', default=None)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+    asyncio.run(serve(args.index, args.doc_mapping, args.host, args.port, args.workers))
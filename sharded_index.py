@@ -0,0 +1,158 @@
+import math
+import zlib
+import threading
+import multiprocessing
+from index_file import write_binary_index
+from run_query import QueryEngine
+
+
+def shard_of(doc_id, doc_name, num_shards, method='hash'):
+    """
+    Returns the shard a document belongs to.
+    'hash' spreads documents by doc id, 'artist' keeps all the songs of an artist (the part of the doc name before '_') together
+    """
+    if method == 'hash':
+        return int(doc_id) % num_shards
+    if method == 'artist':
+        return zlib.crc32(doc_name.split('_', 1)[0].encode('utf-8')) % num_shards
+    raise ValueError(f'unknown sharding method {method}')
+
+
+def partition_index(inverted_index, doc_map, num_shards, method='hash'):
+    """
+    Splits a raw count index {term: [doc_freq, total_freq, postings_list]} by document.
+    Returns a list of (shard_index, shard_doc_map), each shard index only has the postings of its own documents
+    and its own local doc_freq and total_freq
+    """
+    doc_shards = {int(doc_id): shard_of(doc_id, values[0], num_shards, method) for doc_id, values in doc_map.items()}
+    shards = [({}, {}) for i in range(num_shards)]
+    for doc_id, values in doc_map.items():
+        shards[doc_shards[int(doc_id)]][1][int(doc_id)] = [values[0], 0]
+
+    for term, (doc_freq, total_freq, postings) in inverted_index.items():
+        for doc_id, freq in postings:
+            shard_index = shards[doc_shards[doc_id]][0]
+            if term in shard_index:
+                shard_index[term][0] += 1
+                shard_index[term][1] += freq
+                shard_index[term][2].append([doc_id, freq])
+            else:
+                shard_index[term] = [1, freq, [[doc_id, freq]]]
+    return shards
+
+
+def global_statistics(shards):
+    """
+    Combines the local statistics of the shards into the global number of documents and {term: doc_freq}
+    """
+    total_docs = 0
+    doc_freqs = {}
+    for shard_index, shard_doc_map in shards:
+        total_docs += len(shard_doc_map)
+        for term, values in shard_index.items():
+            doc_freqs[term] = doc_freqs.get(term, 0) + values[0]
+    return total_docs, doc_freqs
+
+
+def weight_shard(shard_index, shard_doc_map, total_docs, doc_freqs):
+    """
+    tf-idf weights a shard with the global idf and computes the vector lengths of its documents.
+    A document lives in a single shard so its length only depends on the shard's postings
+    """
+    weighted_index = {}
+    for term, (doc_freq, total_freq, postings) in shard_index.items():
+        idf = math.log(total_docs / doc_freqs[term], 2)
+        weighted_index[term] = [doc_freq, total_freq, [[doc_id, freq * idf] for doc_id, freq in postings]]
+
+    for doc_id, values in shard_doc_map.items():
+        values[1] = 0
+    for term, values in weighted_index.items():
+        for doc_id, weight in values[2]:
+            shard_doc_map[doc_id][1] += weight**2
+    for doc_id, values in shard_doc_map.items():
+        values[1] = math.sqrt(values[1])
+    return weighted_index
+
+
+def export_shards(inverted_index, doc_map, file_prefix, num_shards, method='hash', weight_bits=None):
+    """
+    Partitions a raw count index, weights every shard with the global statistics and writes each shard to a binary index file.
+    Returns the shard file names
+    """
+    shards = partition_index(inverted_index, doc_map, num_shards, method)
+    total_docs, doc_freqs = global_statistics(shards)
+
+    filenames = []
+    for i, (shard_index, shard_doc_map) in enumerate(shards):
+        weighted_index = weight_shard(shard_index, shard_doc_map, total_docs, doc_freqs)
+        filename = f'{file_prefix}_shard{i}.idx'
+        write_binary_index(filename, weighted_index, shard_doc_map, weight_bits=weight_bits)
+        filenames.append(filename)
+    return filenames
+
+
+def _shard_worker(conn, shard_file):
+    """
+    Serves queries against one shard until it receives None
+    """
+    engine = QueryEngine(shard_file)
+    while True:
+        request = conn.recv()
+        if request is None:
+            break
+        query, num_results = request
+        results = engine.query(query, num_results=num_results, print_results=False)
+        conn.send([(doc_id, score, engine.doc_mapping[doc_id][0]) for doc_id, score in results])
+    engine.close()
+    conn.close()
+
+
+class ShardedQueryEngine:
+    """
+    Scatter-gather coordinator over shard files written by export_shards.
+    Every shard is served by its own process. A query is sent to all shards, each returns its local top n,
+    and the coordinator merges them. Since the shards were weighted with global statistics the merged ranking
+    is the same as the one of a QueryEngine over the unsharded index
+    """
+
+    def __init__(self, shard_files):
+        self.connections = []
+        self.processes = []
+        for shard_file in shard_files:
+            parent_conn, child_conn = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=_shard_worker, args=(child_conn, shard_file), daemon=True)
+            process.start()
+            self.connections.append(parent_conn)
+            self.processes.append(process)
+
+        self.lock = threading.Lock()
+        self.doc_mapping = {}   # {doc_id: [doc_name, None]} for the documents in the latest results
+        self.top_results = None
+
+    def query(self, query, num_results=5, print_results='general'):
+        """
+        Returns the top n documents over all shards
+        """
+        with self.lock:
+            for conn in self.connections:
+                conn.send((query, num_results))
+            shard_results = [conn.recv() for conn in self.connections]
+
+        # ties are broken by doc id like in a single QueryEngine
+        merged = sorted((result for results in shard_results for result in results), key=lambda x: (-x[1], int(x[0])))
+        merged = merged[:num_results]
+        self.doc_mapping = {doc_id: [doc_name, None] for doc_id, score, doc_name in merged}
+        self.top_results = [(doc_id, score) for doc_id, score, doc_name in merged]
+
+        if print_results:
+            self.print_results(method=print_results)
+        return self.top_results
+
+    def print_results(self, method='general'):
+        QueryEngine.print_results(self, method)
+
+    def close(self):
+        for conn, process in zip(self.connections, self.processes):
+            conn.send(None)
+            process.join()
+            conn.close()
@@ -0,0 +1,182 @@
+import os
+import json
+import math
+import heapq
+import tempfile
+
+# rough size of one [doc_id, freq] posting and of one dictionary entry in cpython,
+# used to estimate how much memory the in-memory block is using
+POSTING_BYTES = 120
+TERM_BYTES = 200
+
+# most run files open at once while merging, more runs than that are merged in several passes
+MAX_FAN_IN = 64
+
+
+class SpimiIndexBuilder:
+    """
+    Single-pass in-memory indexing (SPIMI) for corpora that do not fit in memory.
+    Postings are collected in a block until the memory budget is reached, the block is then sorted by term
+    and flushed to disk as a run. At the end the runs are merged term by term and the index is streamed to disk,
+    so peak memory depends on the budget and not on the size of the corpus
+    """
+
+    def __init__(self, inverted_index, memory_budget=64 * 1024 * 1024, temp_dir=None, max_fan_in=MAX_FAN_IN):
+        self.index = inverted_index   # InvertedIndex that provides the documents and tokenizer
+        self.memory_budget = memory_budget
+        self.temp_dir = temp_dir
+        self.max_fan_in = max(2, max_fan_in)
+        self.run_files = []
+
+    def build(self, raw_index_file, weighted_index_file=None):
+        """
+        Writes the raw count index (and optionally the tf-idf weighted index) as json to the given files.
+        Fills in the document mapping of the InvertedIndex, including the doc vector lengths if the weighted index is written
+        """
+        doc_map = self.index.doc_map
+        try:
+            self.invert_blocks()
+            self.merge_runs(raw_index_file, weighted_index_file)
+        finally:
+            for run_file in self.run_files:
+                os.remove(run_file)
+            self.run_files = []
+        return doc_map
+
+    def invert_blocks(self):
+        """
+        Tokenizes every document and flushes a sorted run whenever the block goes over the memory budget
+        """
+        block = {}  # {term: [[doc_id, freq], ...]}
+        block_bytes = 0
+        for i, (doc_name, text) in enumerate(self.index.source):
+            doc_id = i + 1
+            self.index.doc_map[doc_id] = [doc_name, 0]
+            for term, freq in self.index.tokenize_text(text).items():
+                if term in block:
+                    block[term].append([doc_id, freq])
+                else:
+                    block[term] = [[doc_id, freq]]
+                    block_bytes += TERM_BYTES
+                block_bytes += POSTING_BYTES
+
+            if block_bytes >= self.memory_budget:
+                self.flush_block(block)
+                block = {}
+                block_bytes = 0
+
+        if block:
+            self.flush_block(block)
+
+    def flush_block(self, block):
+        """
+        Writes a block to a run file, one term per line in sorted term order
+        """
+        self.run_files.append(self.write_run((term, block[term]) for term in sorted(block)))
+
+    def write_run(self, entries):
+        fd, run_file = tempfile.mkstemp(prefix='spimi_run_', suffix='.jsonl', dir=self.temp_dir)
+        with os.fdopen(fd, 'w') as f:
+            for term, postings in entries:
+                f.write(json.dumps([term, postings]) + '\n')
+        return run_file
+
+    def read_run(self, run_file):
+        with open(run_file) as f:
+            for line in f:
+                yield json.loads(line)
+
+    def merge_terms(self, run_files):
+        """
+        k-way merges run files, yielding (term, postings) in sorted term order.
+        Runs were written in doc id order and heapq.merge keeps equal terms in run order,
+        so concatenating the postings keeps them sorted by doc id
+        """
+        runs = [self.read_run(run_file) for run_file in run_files]
+        current_term = None
+        postings = []
+        for term, run_postings in heapq.merge(*runs, key=lambda entry: entry[0]):
+            if term != current_term:
+                if current_term is not None:
+                    yield current_term, postings
+                current_term = term
+                postings = []
+            postings.extend(run_postings)
+        if current_term is not None:
+            yield current_term, postings
+
+    def reduce_runs(self):
+        """
+        Merges groups of max_fan_in consecutive runs into single runs until at most max_fan_in are left,
+        so no merge has more run files open than that. Consecutive runs keep the doc id order of the postings
+        """
+        while len(self.run_files) > self.max_fan_in:
+            run_files = []
+            for i in range(0, len(self.run_files), self.max_fan_in):
+                group = self.run_files[i:i + self.max_fan_in]
+                run_files.append(self.write_run(self.merge_terms(group)) if len(group) > 1 else group[0])
+            for run_file in self.run_files:
+                if run_file not in run_files:
+                    os.remove(run_file)
+            self.run_files = run_files
+
+    def merge_runs(self, raw_index_file, weighted_index_file=None):
+        """
+        Merges the runs (in several passes if there are more than max_fan_in) and streams the merged index to disk in sorted term order
+        """
+        doc_map = self.index.doc_map
+        total_docs = self.index.total_docs = len(doc_map)
+        for values in doc_map.values():
+            values[1] = 0
+
+        self.reduce_runs()
+
+        raw_writer = JsonIndexWriter(raw_index_file)
+        weighted_writer = JsonIndexWriter(weighted_index_file) if weighted_index_file else None
+
+        for term, postings in self.merge_terms(self.run_files):
+            self.write_term(term, postings, total_docs, raw_writer, weighted_writer)
+
+        raw_writer.close()
+        if weighted_writer:
+            weighted_writer.close()
+            for values in doc_map.values():
+                values[1] = math.sqrt(values[1])
+
+    def write_term(self, term, postings, total_docs, raw_writer, weighted_writer):
+        doc_freq = len(postings)
+        total_freq = sum(freq for doc_id, freq in postings)
+        raw_writer.write(term, [doc_freq, total_freq, postings])
+
+        if weighted_writer:
+            # same weighting as InvertedIndex.calculate_weighted_index(method='tf_idf')
+            idf = math.log(total_docs / doc_freq, 2)
+            weighted_postings = [[doc_id, freq * idf] for doc_id, freq in postings]
+            weighted_writer.write(term, [doc_freq, total_freq, weighted_postings])
+            for doc_id, weight in weighted_postings:
+                self.index.doc_map[doc_id][1] += weight**2
+
+
+class JsonIndexWriter:
+    """
+    Streams {term: values} entries to a json file one at a time, producing the same output as json.dump on the whole dict.
+    The entries go to a temporary file that is moved in place on close
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.temp_filename = filename + '.tmp'
+        self.f = open(self.temp_filename, 'w')
+        self.f.write('{')
+        self.first = True
+
+    def write(self, term, values):
+        if not self.first:
+            self.f.write(', ')
+        self.first = False
+        self.f.write(json.dumps(term) + ': ' + json.dumps(values))
+
+    def close(self):
+        self.f.write('}')
+        self.f.close()
+        os.replace(self.temp_filename, self.filename)
@@ -0,0 +1,145 @@
+import re
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from postings_ops import intersect
+
+
+def index_doc_freqs(index):
+    """
+    Returns {term: doc_freq} of an index (json dict, BinaryIndex or WeightedIndexView) without decoding its postings
+    """
+    if hasattr(index, 'doc_freqs'):
+        return dict(index.doc_freqs())
+    return {term: values[0] for term, values in index.items()}
+
+
+def edit_distance(a, b, max_distance):
+    """
+    Levenshtein distance between a and b, or max_distance + 1 as soon as it is known to be larger than max_distance
+    """
+    too_far = max_distance + 1
+    if abs(len(a) - len(b)) > max_distance:
+        return too_far
+
+    # only the cells within max_distance of the diagonal can stay within max_distance
+    previous = [j if j <= max_distance else too_far for j in range(len(b) + 1)]
+    for i in range(1, len(a) + 1):
+        lo = max(1, i - max_distance)
+        hi = min(len(b), i + max_distance)
+        current = [too_far] * (len(b) + 1)
+        current[0] = i if i <= max_distance else too_far
+        char_a = a[i - 1]
+        best = current[0] if lo == 1 else too_far
+        for j in range(lo, hi + 1):
+            cost = previous[j - 1] if char_a == b[j - 1] else previous[j - 1] + 1
+            if previous[j] + 1 < cost:
+                cost = previous[j] + 1
+            if current[j - 1] + 1 < cost:
+                cost = current[j - 1] + 1
+            current[j] = cost
+            if cost < best:
+                best = cost
+        if best > max_distance:
+            return too_far
+        previous = current
+    return min(previous[-1], too_far)
+
+
+class TermDictionary:
+    """
+    Term lookups other than exact match, built from the terms of an index.
+    A sorted array of the terms answers prefix queries with two binary searches, and a k-gram index
+    ({k-gram: sorted term ids}, terms padded with '$') gives the candidates of wildcard patterns and of terms within
+    a bounded edit distance, so neither has to scan the whole vocabulary. Terms are also bucketed by length
+    ({length: term ids}) for the fuzzy lookups of words too short for the k-grams to rule anything out
+    """
+
+    def __init__(self, doc_freqs, k=2):
+        self.k = k
+        self.terms = sorted(doc_freqs)
+        self.doc_freqs = array('I', (doc_freqs[term] for term in self.terms))
+
+        grams = {}
+        lengths = {}
+        for term_id, term in enumerate(self.terms):
+            for gram in self.grams(f'${term}$'):
+                grams.setdefault(gram, array('I')).append(term_id)
+            lengths.setdefault(len(term), array('I')).append(term_id)
+        self.kgram_index = grams
+        self.length_index = lengths
+
+    def grams(self, text):
+        return {text[i:i + self.k] for i in range(len(text) - self.k + 1)}
+
+    def __len__(self):
+        return len(self.terms)
+
+    def __contains__(self, term):
+        i = bisect_left(self.terms, term)
+        return i < len(self.terms) and self.terms[i] == term
+
+    def most_frequent(self, term_ids, limit):
+        term_ids = sorted(term_ids, key=lambda term_id: (-self.doc_freqs[term_id], term_id))
+        return [self.terms[term_id] for term_id in term_ids[:limit]]
+
+    def prefix(self, prefix, limit=None):
+        """
+        Returns the terms that start with prefix, the most frequent first
+        """
+        lo = bisect_left(self.terms, prefix)
+        hi = bisect_left(self.terms, prefix + '\U0010ffff', lo)
+        return self.most_frequent(range(lo, hi), limit)
+
+    def wildcard(self, pattern, limit=None):
+        """
+        Returns the terms matching a pattern where * matches any characters and ? a single one, the most frequent first.
+        Candidates are the terms that have every k-gram of the literal parts of the pattern, they are checked against the pattern after
+        """
+        if '*' not in pattern and '?' not in pattern:
+            return [pattern] if pattern in self else []
+        literal = pattern.rstrip('*')
+        if '*' not in literal and '?' not in literal:
+            return self.prefix(literal, limit)
+
+        regex = re.compile(''.join('.*' if char == '*' else '.' if char == '?' else re.escape(char) for char in pattern) + r'\Z')
+        grams = set()
+        for part in re.split(r'[*?]', f'${pattern}$'):
+            grams |= self.grams(part)
+
+        if grams:
+            if any(gram not in self.kgram_index for gram in grams):
+                return []
+            candidates = [term_id for term_id, indexes in intersect([self.kgram_index[gram] for gram in grams])]
+        else:
+            candidates = range(len(self.terms))
+        return self.most_frequent([term_id for term_id in candidates if regex.match(self.terms[term_id])], limit)
+
+    def fuzzy(self, word, max_distance=2, limit=None):
+        """
+        Returns [(term, edit distance)] of the terms within max_distance edits of word, closest and then most frequent first.
+        An edit changes at most k of the k-grams of a word, so only terms sharing enough k-grams with it are compared,
+        and only terms whose length is within max_distance of the word's
+        """
+        word_grams = self.grams(f'${word}$')
+        min_shared = len(word_grams) - self.k * max_distance
+        shared = Counter()
+        for gram in word_grams:
+            shared.update(self.kgram_index.get(gram, ()))
+
+        if min_shared > 0:
+            candidates = [term_id for term_id, count in shared.items() if count >= min_shared]
+        else:
+            # a short word can be max_distance edits away from terms it shares no k-gram with,
+            # every term of a close enough length is a candidate then
+            candidates = []
+            for length in range(max(0, len(word) - max_distance), len(word) + max_distance + 1):
+                candidates.extend(self.length_index.get(length, ()))
+
+        matches = []
+        for term_id in candidates:
+            distance = edit_distance(word, self.terms[term_id], max_distance)
+            if distance <= max_distance:
+                matches.append((distance, -self.doc_freqs[term_id], self.terms[term_id]))
+        matches.sort()
+        return [(term, distance) for distance, doc_freq, term in matches[:limit]]
@@ -0,0 +1,116 @@
+import os
+import sys
+import time
+import string
+import functools
+import nltk
+
+
+class TextAnalyzer:
+    """
+    Text processing pipeline shared by InvertedIndex and QueryEngine.
+    Removes puncuation
+    Tokenizes and lowercases
+    Removes stop words
+    Removes non ascii words
+    Performs stemming (unless stemming=False)
+    """
+
+    def __init__(self, stem_cache_size=100000, stemming=True):
+        self.stemming = stemming
+        self.stemmer = nltk.PorterStemmer()
+        self.stop_words = frozenset(nltk.corpus.stopwords.words('english'))
+        self.punctuation_table = str.maketrans('', '', string.punctuation)
+
+        # porter stemming is the expensive step and the vocabulary is small compared to the number of tokens,
+        # so stems are memoized in a bounded lru cache
+        self.stem = functools.lru_cache(maxsize=stem_cache_size)(self.stemmer.stem)
+
+        self.tokens_processed = 0   # words seen before stop word removal
+        self.seconds = 0            # time spent analyzing
+
+    def analyze(self, text):
+        """
+        Returns the list of stems (or words when stemming is off) in a piece of text
+        """
+        start = time.perf_counter()
+        stem = self.stem
+        stop_words = self.stop_words
+        words = text.translate(self.punctuation_table).lower().split()
+
+        # get rid of the word if it has any non-ascii characters or it is a stop word
+        if self.stemming:
+            stems = [stem(word) for word in words if word not in stop_words and word.isascii()]
+        else:
+            stems = [word for word in words if word not in stop_words and word.isascii()]
+
+        self.tokens_processed += len(words)
+        self.seconds += time.perf_counter() - start
+        return stems
+
+    def count_terms(self, lines):
+        """
+        Returns {stem: count} over an iterable of lines (e.g. an open file)
+        """
+        token_dict = {}
+        for line in lines:
+            for stem in self.analyze(line):
+                token_dict[stem] = token_dict.get(stem, 0) + 1
+        return token_dict
+
+    def tokens_per_second(self):
+        return self.tokens_processed / self.seconds if self.seconds else 0
+
+    def stats(self):
+        """
+        Returns the throughput and stem cache statistics
+        """
+        cache_info = self.stem.cache_info()
+        return {
+            'tokens_processed': self.tokens_processed,
+            'seconds': self.seconds,
+            'tokens_per_second': self.tokens_per_second(),
+            'stem_cache_hits': cache_info.hits,
+            'stem_cache_misses': cache_info.misses,
+            'stem_cache_size': cache_info.currsize,
+        }
+
+
+def legacy_count_terms(lines, stemmer, stop_words):
+    """
+    The per line pipeline InvertedIndex used before TextAnalyzer, kept to compare throughput against
+    """
+    token_dict = {}
+    for line in lines:
+        line = line.translate(str.maketrans('', '', string.punctuation))
+        words = [word.strip().lower() for word in line.split()]
+        for word in words:
+            if word not in stop_words and all(ord(char) < 128 for char in word):
+                stem = stemmer.stem(word)
+                if stem in token_dict:
+                    token_dict[stem] += 1
+                else:
+                    token_dict[stem] = 1
+    return token_dict
+
+
+# compares the analyzer with the old pipeline on a corpus folder: python text_analyzer.py corpus_songs
+if __name__ == '__main__':
+    corpus_root = sys.argv[1] if len(sys.argv) > 1 else os.getcwd() + '/corpus'
+    documents = []
+    for filename in sorted(os.listdir(corpus_root)):
+        with open(os.path.join(corpus_root, filename), 'r', encoding='latin1') as f:
+            documents.append(f.readlines())
+
+    analyzer = TextAnalyzer()
+    analyzed = [analyzer.count_terms(lines) for lines in documents]
+
+    stemmer = nltk.PorterStemmer()
+    stop_words = nltk.corpus.stopwords.words('english')
+    start = time.perf_counter()
+    legacy = [legacy_count_terms(lines, stemmer, stop_words) for lines in documents]
+    legacy_seconds = time.perf_counter() - start
+
+    print(f'same tokens: {analyzed == legacy}')
+    print(f'analyzer: {analyzer.tokens_per_second():,.0f} tokens/sec')
+    print(f'legacy:   {analyzer.tokens_processed / legacy_seconds:,.0f} tokens/sec')
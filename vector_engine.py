@@ -0,0 +1,147 @@
+from run_query import QueryEngine
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# number of queries scored together by query_batch, bounds the size of the dense (queries x docs) score matrix
+BATCH_SIZE = 256
+
+
+class VectorQueryEngine(QueryEngine):
+    """
+    QueryEngine that keeps the weighted index as a sparse term by doc matrix in CSR form (numpy arrays)
+    with the postings already multiplied by the inverse doc vector lengths.
+    A query is scored as one sparse matrix-vector product and the top n are selected with numpy instead of a python loop per posting.
+    Scores can differ from QueryEngine in the last bits because the doc lengths are applied as precomputed inverses
+    """
+
+    def __init__(self, inverted_index_file, doc_mapping_file=None, analyzer=None, cache_size=1024, cache_ttl=None, metrics=None, weighting=None,
+                 compact=False, normalize_query=True):
+        if np is None:
+            raise ImportError('VectorQueryEngine requires numpy')
+        super().__init__(inverted_index_file, doc_mapping_file, analyzer, cache_size, cache_ttl, metrics, weighting, compact=compact,
+                         normalize_query=normalize_query)
+
+    def load_index(self):
+        super().load_index()
+        self.build_matrix()
+
+    def build_matrix(self):
+        """
+        Builds the CSR arrays: row i of the matrix holds the postings of term i, columns are documents sorted by doc id
+        """
+        self.doc_ids = np.array(sorted(int(doc_id) for doc_id in self.doc_mapping.keys()), dtype=np.int64)
+        self.num_docs = len(self.doc_ids)
+        doc_lengths = np.array([self.doc_mapping[str(doc_id)][1] for doc_id in self.doc_ids], dtype=np.float64)
+        self.inverse_doc_lengths = np.divide(1.0, doc_lengths, out=np.zeros_like(doc_lengths), where=doc_lengths != 0)
+
+        # doc id -> column
+        columns = np.full(int(self.doc_ids.max()) + 1 if self.num_docs else 1, -1, dtype=np.int64)
+        columns[self.doc_ids] = np.arange(self.num_docs)
+
+        self.term_ids = {}
+        indptr = [0]
+        indices = []
+        data = []
+        for term in self.inverted_index.keys():
+            doc_ids, weights = self.term_postings(term)
+            self.term_ids[term] = len(self.term_ids)
+            indices.append(columns[np.asarray(doc_ids, dtype=np.int64)])
+            data.append(np.asarray(weights, dtype=np.float64))
+            indptr.append(indptr[-1] + len(doc_ids))
+
+        self.indptr = np.array(indptr, dtype=np.int64)
+        self.indices = np.concatenate(indices) if indices else np.zeros(0, dtype=np.int64)
+        self.data = np.concatenate(data) if data else np.zeros(0, dtype=np.float64)
+        self.data *= self.inverse_doc_lengths[self.indices]
+
+    def query_vector(self, query_terms, term_weights=None):
+        """
+        Returns the (term rows, weights) of a processed query, repeated terms get a higher weight.
+        term_weights {term: weight} gives the weights of expanded terms, the query length is then the one expanded_query set
+        """
+        term_counts = {}
+        if term_weights is None:
+            for term in query_terms:
+                if term in self.term_ids:
+                    term_counts[self.term_ids[term]] = term_counts.get(self.term_ids[term], 0) + 1
+            query_length = np.sqrt(len(query_terms)) if query_terms else 1.0
+        else:
+            for term, weight in term_weights.items():
+                if term in self.term_ids:
+                    term_counts[self.term_ids[term]] = weight
+            query_length = self.query_length or 1.0
+        if not self.normalize_query:
+            query_length = 1.0
+        rows = np.fromiter(term_counts.keys(), dtype=np.int64, count=len(term_counts))
+        weights = np.fromiter(term_counts.values(), dtype=np.float64, count=len(term_counts)) / query_length
+        return rows, weights
+
+    def gather(self, rows, weights):
+        """
+        Returns the (columns, contributions) of all postings of the given term rows scaled by the query weights
+        """
+        starts = self.indptr[rows]
+        lengths = self.indptr[rows + 1] - starts
+        total = int(lengths.sum())
+        if total == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float64)
+
+        # positions of every posting of every row in the flat indices/data arrays
+        offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(total)
+        return self.indices[offsets], self.data[offsets] * np.repeat(weights, lengths)
+
+    def score(self, query_terms, term_weights=None):
+        """
+        Returns the dense vector of cosine scores of every document (in doc id order) for a processed query
+        """
+        rows, weights = self.query_vector(query_terms, term_weights)
+        columns, contributions = self.gather(rows, weights)
+        self.metrics.incr('postings_scanned', len(columns))
+        self.metrics.incr('docs_scored', self.num_docs)
+        return np.bincount(columns, weights=contributions, minlength=self.num_docs)
+
+    def select_top_k(self, scores, k):
+        """
+        Returns the (doc_id, score) pairs of the k highest scores, ties broken by doc id like the python engine
+        """
+        k = min(k, len(scores))
+        if k <= 0:
+            return []
+
+        # take everything above the k-th largest score and fill up with the lowest doc ids that tie with it
+        kth_score = np.partition(scores, len(scores) - k)[len(scores) - k]
+        above = np.flatnonzero(scores > kth_score)
+        ties = np.flatnonzero(scores == kth_score)[:k - len(above)]
+        candidates = np.concatenate((above, ties))
+        candidates = candidates[np.lexsort((candidates, -scores[candidates]))]
+        return [(str(doc_id), float(score)) for doc_id, score in zip(self.doc_ids[candidates], scores[candidates])]
+
+    def top_k(self, query_terms, k, term_weights=None):
+        return self.select_top_k(self.score(query_terms, term_weights), k)
+
+    def query_batch(self, queries, k=5):
+        """
+        Returns the top k results for each query in a list.
+        Queries are scored BATCH_SIZE at a time as one sparse (queries x terms) by (terms x docs) product
+        """
+        self.check_index_version()
+        results = []
+        for start in range(0, len(queries), BATCH_SIZE):
+            batch = [self.preprocess_query(query) for query in queries[start:start + BATCH_SIZE]]
+
+            flat_positions = []
+            flat_contributions = []
+            for i, query_terms in enumerate(batch):
+                rows, weights = self.query_vector(query_terms)
+                columns, contributions = self.gather(rows, weights)
+                flat_positions.append(columns + i * self.num_docs)
+                flat_contributions.append(contributions)
+
+            scores = np.bincount(np.concatenate(flat_positions), weights=np.concatenate(flat_contributions),
+                                 minlength=len(batch) * self.num_docs).reshape(len(batch), self.num_docs)
+            for row in scores:
+                results.append(self.select_top_k(row, k))
+        return results
@@ -0,0 +1,257 @@
+import math
+
+
+class WeightingScheme:
+    """
+    Base class of the term weighting schemes.
+    A scheme turns the raw term counts of a posting into a weight and gives every document a normalizer,
+    the score of a document is sum(weight) / (normalizer * query_length).
+    prepare() has to be called with the collection statistics before weights are computed
+    """
+
+    name = None
+    # divide the scores by the length of the query vector (cosine), does not change the ranking
+    normalize_query = True
+
+    def prepare(self, total_docs, doc_tokens):
+        """
+        total_docs is the number of documents, doc_tokens {doc_id: number of indexed tokens} is the length of every document
+        """
+        self.total_docs = total_docs
+        self.doc_tokens = doc_tokens
+        self.avg_doc_tokens = sum(doc_tokens.values()) / len(doc_tokens) if doc_tokens else 0
+
+    def idf(self, doc_freq):
+        return math.log(self.total_docs / doc_freq, 2)
+
+    def weight(self, freq, idf, doc_id):
+        raise NotImplementedError
+
+    def doc_norms(self, weighted_postings):
+        """
+        Returns {doc_id: normalizer} given the weighted postings lists [(doc_ids, weights), ...] of all terms.
+        The default is the length of the document vector (cosine normalization)
+        """
+        norms = {doc_id: 0 for doc_id in self.doc_tokens}
+        for doc_ids, weights in weighted_postings:
+            for doc_id, weight in zip(doc_ids, weights):
+                norms[doc_id] += weight**2
+        return {doc_id: math.sqrt(norm) for doc_id, norm in norms.items()}
+
+
+class TfIdf(WeightingScheme):
+    """
+    tf * log2(N / df) with cosine normalization, the weighting calculate_weighted_index has always used
+    """
+
+    name = 'tf_idf'
+
+    def weight(self, freq, idf, doc_id):
+        return freq * idf
+
+
+class LogTfIdf(WeightingScheme):
+    """
+    (1 + log2(tf)) * log2(N / df) with cosine normalization, dampens terms repeated many times in a song (hooks)
+    """
+
+    name = 'log_tf_idf'
+
+    def weight(self, freq, idf, doc_id):
+        return (1 + math.log(freq, 2)) * idf if freq > 0 else 0
+
+
+class PivotedTfIdf(LogTfIdf):
+    """
+    log tf-idf with pivoted length normalization: the normalizer is (1 - slope) * pivot + slope * doc_vector_length
+    where the pivot is the average doc vector length, so long documents are penalized less than by plain cosine
+    """
+
+    name = 'pivoted'
+
+    def __init__(self, slope=0.2):
+        self.slope = slope
+
+    def doc_norms(self, weighted_postings):
+        lengths = super().doc_norms(weighted_postings)
+        pivot = sum(lengths.values()) / len(lengths) if lengths else 0
+        return {doc_id: (1 - self.slope) * pivot + self.slope * length for doc_id, length in lengths.items()}
+
+
+class BM25(WeightingScheme):
+    """
+    Okapi BM25. The length normalization is part of the weight so the documents are not normalized afterwards
+    """
+
+    name = 'bm25'
+    normalize_query = False
+
+    def __init__(self, k1=1.2, b=0.75):
+        self.k1 = k1
+        self.b = b
+
+    def idf(self, doc_freq):
+        return math.log(1 + (self.total_docs - doc_freq + 0.5) / (doc_freq + 0.5))
+
+    def weight(self, freq, idf, doc_id):
+        length_ratio = self.doc_tokens[doc_id] / self.avg_doc_tokens if self.avg_doc_tokens else 0
+        return idf * freq * (self.k1 + 1) / (freq + self.k1 * (1 - self.b + self.b * length_ratio))
+
+    def doc_norms(self, weighted_postings):
+        return {doc_id: 1 for doc_id in self.doc_tokens}
+
+
+SCHEMES = {scheme.name: scheme for scheme in (TfIdf, LogTfIdf, PivotedTfIdf, BM25)}
+
+
+def get_scheme(scheme):
+    """
+    Returns a weighting scheme given its name ('tf_idf', 'log_tf_idf', 'pivoted', 'bm25') or a WeightingScheme instance
+    """
+    if isinstance(scheme, WeightingScheme):
+        return scheme
+    if scheme not in SCHEMES:
+        raise ValueError(f'unknown weighting scheme {scheme}, choose one of {", ".join(SCHEMES)}')
+    return SCHEMES[scheme]()
+
+
+def raw_postings(raw_index, term):
+    """
+    Returns the (doc_ids, counts) of a term in a raw count index (json dict or BinaryIndex) or None if the term is not in it
+    """
+    if hasattr(raw_index, 'postings'):
+        return raw_index.postings(term)
+    if term not in raw_index:
+        return None
+    postings = raw_index[term][2]
+    return [posting[0] for posting in postings], [posting[1] for posting in postings]
+
+
+def iter_raw_postings(raw_index):
+    """
+    Yields (term, doc_ids, counts) for every term of a raw count index (json dict or BinaryIndex) in index order
+    """
+    if hasattr(raw_index, 'iter_postings'):
+        yield from raw_index.iter_postings()
+        return
+    for term, values in raw_index.items():
+        postings = values[2]
+        yield term, [posting[0] for posting in postings], [posting[1] for posting in postings]
+
+
+def document_token_counts(raw_index, doc_ids):
+    """
+    Returns {doc_id: sum of the term counts of the document} from a raw count index
+    """
+    doc_tokens = {doc_id: 0 for doc_id in doc_ids}
+    for term, postings_doc_ids, counts in iter_raw_postings(raw_index):
+        for doc_id, freq in zip(postings_doc_ids, counts):
+            doc_tokens[doc_id] += freq
+    return doc_tokens
+
+
+class WeightedIndexView:
+    """
+    Applies a weighting scheme to a raw count index at query time instead of storing a weighted copy of the postings.
+    Only the idf of every term and the normalizer of every document are precomputed,
+    so one raw count index serves every scheme. Has the postings / max_score interface of BinaryIndex
+    and doc_mapping is a {doc_id: [doc_name, normalizer]} view for QueryEngine
+    """
+
+    def __init__(self, raw_index, doc_mapping, scheme='tf_idf'):
+        self.raw_index = raw_index
+        self.scheme = get_scheme(scheme)
+
+        # one pass for the document lengths and document frequencies, a second one for the document normalizers
+        doc_tokens = {int(doc_id): 0 for doc_id in doc_mapping.keys()}
+        self.term_doc_freqs = {}
+        for term, doc_ids, counts in iter_raw_postings(raw_index):
+            self.term_doc_freqs[term] = len(doc_ids)
+            for doc_id, freq in zip(doc_ids, counts):
+                doc_tokens[doc_id] += freq
+        self.scheme.prepare(len(doc_tokens), doc_tokens)
+        self.idfs = {term: self.scheme.idf(doc_freq) for term, doc_freq in self.term_doc_freqs.items()}
+
+        self.norms = self.scheme.doc_norms(self.weight_postings(term, doc_ids, counts) for term, doc_ids, counts in iter_raw_postings(raw_index))
+        self.doc_mapping = NormalizedDocMapping(doc_mapping, self.norms)
+        self.max_scores = {}
+
+    def postings(self, term):
+        """
+        Returns the (doc_ids, weights) of a term weighted by the scheme or None if the term is not in the index
+        """
+        postings = raw_postings(self.raw_index, term)
+        if postings is None:
+            return None
+        return self.weight_postings(term, *postings)
+
+    def weight_postings(self, term, doc_ids, counts):
+        idf = self.idfs[term]
+        weight = self.scheme.weight
+        return doc_ids, [weight(freq, idf, doc_id) for doc_id, freq in zip(doc_ids, counts)]
+
+    def max_score(self, term):
+        """
+        Returns the largest weight / normalizer in the postings list of a term
+        """
+        if term not in self.max_scores:
+            postings = self.postings(term)
+            if postings is None:
+                raise KeyError(term)
+            max_score = 0
+            for doc_id, weight in zip(*postings):
+                if self.norms[doc_id]:
+                    max_score = max(max_score, weight / self.norms[doc_id])
+            self.max_scores[term] = max_score
+        return self.max_scores[term]
+
+    def doc_freqs(self):
+        return self.term_doc_freqs.items()
+
+    def __len__(self):
+        return len(self.idfs)
+
+    def __contains__(self, term):
+        return term in self.idfs
+
+    def __getitem__(self, term):
+        postings = self.postings(term)
+        if postings is None:
+            raise KeyError(term)
+        doc_ids, weights = postings
+        return [len(doc_ids), self.raw_index[term][1], [[doc_id, weight] for doc_id, weight in zip(doc_ids, weights)]]
+
+    def keys(self):
+        return self.idfs.keys()
+
+    def __iter__(self):
+        return iter(self.idfs)
+
+
+class NormalizedDocMapping:
+    """
+    {doc_id: [doc_name, normalizer]} view over a document mapping with the normalizers of a weighting scheme
+    """
+
+    def __init__(self, doc_mapping, norms):
+        self._doc_mapping = doc_mapping
+        self._norms = norms
+
+    def __len__(self):
+        return len(self._doc_mapping)
+
+    def __contains__(self, doc_id):
+        return int(doc_id) in self._norms
+
+    def __getitem__(self, doc_id):
+        return [self._doc_mapping[str(doc_id)][0], self._norms[int(doc_id)]]
+
+    def keys(self):
+        return self._doc_mapping.keys()
+
+    def items(self):
+        for doc_id, values in self._doc_mapping.items():
+            yield doc_id, [values[0], self._norms[int(doc_id)]]
+
+    def __iter__(self):
+        return iter(self._doc_mapping.keys())